@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Benchmark runner for the interpreter.
+# Every workload in bench/workloads is run in process a number of times, measuring
+# the latency of Runtime.run (parse from the .jlc cache + compile + execute),
+# and its peak memory, and once more per sample as a fresh `main.py` process to
+# measure startup. Results can be saved as a baseline, and compared against one:
+# the runner exits with 1 when a workload got slower than the threshold allows.
+#
+# Usage (from the repository root, imports in the workloads are relative to it):
+#   ./bench/run.py [--engine ENGINE] [--iterations N] [--save FILE] [--compare FILE] [--threshold 0.1] [WORKLOAD...]
+
+import contextlib
+import subprocess
+import tracemalloc
+import argparse
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKLOADS = os.path.join(ROOT, 'bench', 'workloads')
+
+sys.path.insert(0, ROOT)
+
+from core.runtime import Runtime, Constants
+from core.parser import Parser
+
+def find_workloads():
+    workloads = {}
+    for name in sorted(os.listdir(WORKLOADS)):
+        path = os.path.join(WORKLOADS, name)
+        if name.endswith('.json'):
+            workloads[name[:-len('.json')]] = path
+        elif os.path.isfile(os.path.join(path, 'main.json')):
+            workloads[name] = os.path.join(path, 'main.json')
+    return workloads
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def run_once(path, engine):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        Runtime.run(Parser.parse_file(path), engine)
+
+def measure(path, engine, iterations, startup_runs):
+    run_once(path, engine)
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run_once(path, engine)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run_once(path, engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    startups = []
+    for _ in range(startup_runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--engine', engine, path],
+                       cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        startups.append(time.perf_counter() - start)
+
+    return {
+        'ops_per_sec': len(latencies) / sum(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_kb': peak / 1024,
+        'startup_ms': percentile(startups, 50) * 1000 if len(startups) > 0 else None,
+    }
+
+def compare(results, baseline, threshold):
+    # A workload regresses when its median latency or startup grew by more than the threshold
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ['p50_ms', 'startup_ms']:
+            old, new = baseline[name].get(metric), result.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append(f'{name}: {metric} {old:.3f} -> {new:.3f} (+{change * 100:.1f}%)')
+    return regressions
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='JsonLang interpreter benchmarks')
+    argparser.add_argument('workloads', nargs='*', help='workloads to run, all of them by default')
+    argparser.add_argument('--engine', choices=Constants.engines, default='compiled')
+    argparser.add_argument('--iterations', type=int, default=20)
+    argparser.add_argument('--startup-runs', type=int, default=5)
+    argparser.add_argument('--save', help='save the results as a JSON baseline')
+    argparser.add_argument('--compare', help='compare the results against a JSON baseline')
+    argparser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown against the baseline (0.1 is 10%%)')
+    args = argparser.parse_args()
+
+    os.chdir(ROOT)
+    workloads = find_workloads()
+    names = args.workloads or list(workloads)
+    for name in names:
+        if name not in workloads:
+            argparser.error(f'unknown workload "{name}", available: {", ".join(workloads)}')
+
+    results = {}
+    print(f'{"workload":<12} {"ops/s":>10} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"peak KiB":>10} {"startup ms":>11}')
+    for name in names:
+        result = measure(workloads[name], args.engine, args.iterations, args.startup_runs)
+        results[name] = result
+        startup = f'{result["startup_ms"]:.1f}' if result['startup_ms'] is not None else '-'
+        print(f'{name:<12} {result["ops_per_sec"]:>10.2f} {result["p50_ms"]:>10.3f} {result["p90_ms"]:>10.3f} '
+              f'{result["p99_ms"]:>10.3f} {result["peak_kb"]:>10.1f} {startup:>11}')
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'engine': args.engine, 'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
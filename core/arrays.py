@@ -0,0 +1,253 @@
+# arrays.py
+
+# Array values for numeric data. With NumPy installed an array is a numpy.ndarray,
+# without it an Array, which does the same element-wise in Python. Either way the
+# operators (+, -, *, /, comparisons) broadcast over arrays: an array and a number,
+# or two arrays of the same length. Reductions and the other builtins below run
+# over the whole array in one call instead of one interpreted loop step per item.
+#
+#   array(list)                    array of the items of a list (or a copy of an array)
+#   list(array)                    list of the items of an array
+#   sum, mean, min, max (array)    reductions, to a number
+#   where(condition, a, b)         items of a where condition holds, of b elsewhere
+#   sort(array)                    sorted copy
+#   map(name, array, ...)          calls the function for every item (of every array)
+#
+# NumPy is imported when the first array is made, not when the interpreter starts.
+#
+# map calls a pure function whose body only does arithmetic on its arguments once,
+# with the whole arrays as arguments, so it's vectorized too.
+# The builtins that build an array or a list charge its length to the budget under limits.
+
+from typing import Any, Callable, Iterator, List, Tuple
+import operator
+
+from .errors import *
+
+from . import runtime
+
+# Set by backend()
+numpy = None
+loaded = False
+
+def elementwise(op: Callable[[Any, Any], Any], reflected: bool = False) -> Callable[['Array', Any], 'Array']:
+    def run(self, other):
+        if isinstance(other, Array):
+            if len(other.items) != len(self.items):
+                raise JsonLangRuntimeError(f'Arrays of lengths {len(self.items)} and {len(other.items)} can\'t be combined')
+            pairs = zip(other.items, self.items) if reflected else zip(self.items, other.items)
+            return Array([op(x, y) for x, y in pairs])
+        if type(other) == list:
+            return run(self, Array(other))
+        if reflected:
+            return Array([op(other, x) for x in self.items])
+        return Array([op(x, other) for x in self.items])
+    return run
+
+class Array:
+    # Stands in for numpy.ndarray when NumPy isn't installed
+    __slots__ = ('items',)
+
+    def __init__(self, items: List):
+        self.items = items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items)
+
+    def __getitem__(self, key: Any) -> Any:
+        if type(key) == slice:
+            return Array(self.items[key])
+        return self.items[key]
+
+    def __setitem__(self, key: Any, value: Any):
+        self.items[key] = value
+
+    def __bool__(self) -> bool:
+        if len(self.items) != 1:
+            raise JsonLangRuntimeError('The truth value of an array with more than one item is ambiguous')
+        return bool(self.items[0])
+
+    def __str__(self) -> str:
+        return '[' + ' '.join(str(x) for x in self.items) + ']'
+
+    def __repr__(self) -> str:
+        return f'array({self.items!r})'
+
+    def tolist(self) -> List:
+        return list(self.items)
+
+    __add__ = elementwise(operator.add)
+    __radd__ = elementwise(operator.add, True)
+    __sub__ = elementwise(operator.sub)
+    __rsub__ = elementwise(operator.sub, True)
+    __mul__ = elementwise(operator.mul)
+    __rmul__ = elementwise(operator.mul, True)
+    __truediv__ = elementwise(operator.truediv)
+    __rtruediv__ = elementwise(operator.truediv, True)
+    __and__ = elementwise(lambda x, y: bool(x and y))
+    __rand__ = elementwise(lambda x, y: bool(x and y), True)
+    __eq__ = elementwise(operator.eq)
+    __ne__ = elementwise(operator.ne)
+    __lt__ = elementwise(operator.lt)
+    __gt__ = elementwise(operator.gt)
+    __hash__ = None
+
+array_types = (Array,)
+
+def backend() -> Any:
+    # Returns NumPy, or None when it isn't installed, importing it the first time
+    global numpy, loaded, array_types
+    if not loaded:
+        loaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            return None
+        numpy = module
+        array_types = (Array, numpy.ndarray)
+    return numpy
+
+def is_array(value: Any) -> bool:
+    if isinstance(value, array_types):
+        return True
+    # An unpickled NumPy array (from an image or a worker process) can come before NumPy was loaded here
+    return not loaded and type(value).__module__ == 'numpy' and backend() is not None and isinstance(value, numpy.ndarray)
+
+def scalar(value: Any) -> Any:
+    # NumPy numbers are turned into Python ones, so they behave like every other value
+    if numpy is not None and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+def to_array(value: Any) -> Any:
+    if not is_array(value) and type(value) != list:
+        raise JsonLangRuntimeError(f'Expected an array or a list, got {type(value).__name__}')
+    if backend() is None:
+        return Array(list(value))
+    return numpy.array(value)
+
+def items(value: Any) -> List:
+    # The items of an array or a list, as Python values
+    if is_array(value):
+        return value.tolist()
+    if type(value) != list:
+        raise JsonLangRuntimeError(f'Expected an array or a list, got {type(value).__name__}')
+    return value
+
+def compare(op: Callable[[Any, Any], Any], left: Any, rights: Iterator) -> Any:
+    # Chained comparison, a < b < c is a < b && b < c, element-wise once arrays are compared
+    result = True
+    for right in rights:
+        result = compare_pair(op, result, left, right)
+        if result is False:
+            return False
+        left = right
+    return result
+
+def compare_pair(op: Callable[[Any, Any], Any], result: Any, left: Any, right: Any) -> Any:
+    # One comparison of a chain, yields the result so far, False once the chain is false
+    ok = op(left, right)
+    if is_array(ok):
+        return ok if result is True else result & ok
+    return result if ok else False
+
+def check_args(name: str, args: List, count: int):
+    if len(args) != count:
+        raise ArgumentMismathError(f'"{name}" expects {count} arguments, but got {len(args)}')
+
+def array(rt, args: List) -> Any:
+    check_args('array', args, 1)
+    return to_array(args[0])
+
+def to_list(rt, args: List) -> List:
+    check_args('list', args, 1)
+    return list(items(args[0]))
+
+def reduction(name: str, reduce_items: Callable[[List], Any]) -> Callable[[Any, List], Any]:
+    # With NumPy, the function of the same name reduces the array
+    def run(rt, args: List) -> Any:
+        check_args(name, args, 1)
+        values = to_array(args[0]) if backend() is not None else items(args[0])
+        if len(values) == 0 and name != 'sum':
+            raise JsonLangRuntimeError(f'"{name}" of an empty array')
+        if numpy is not None:
+            return scalar(getattr(numpy, name)(values))
+        return reduce_items(values)
+    return run
+
+def where(rt, args: List) -> Any:
+    check_args('where', args, 3)
+    condition, a, b = args
+    if backend() is not None:
+        return numpy.where(condition, a, b)
+    condition = items(condition)
+    a = items(a) if is_array(a) or type(a) == list else [a] * len(condition)
+    b = items(b) if is_array(b) or type(b) == list else [b] * len(condition)
+    if len(a) != len(condition) or len(b) != len(condition):
+        raise JsonLangRuntimeError('"where" expects arrays of the same length')
+    return Array([x if c else y for c, x, y in zip(condition, a, b)])
+
+def sort(rt, args: List) -> Any:
+    check_args('sort', args, 1)
+    if backend() is not None:
+        return numpy.sort(to_array(args[0]))
+    return Array(sorted(items(args[0])))
+
+vectorizable_commands = {
+    'comment', 'ignore', 'local', 'var', 'set_local', 'return',
+    '+', '-', '*', '/', '==', '!=', '<', '>', 'add', 'sub', 'mul', 'div', 'eq', 'ne', 'lt', 'gt',
+}
+
+def vectorizable(stmt: Any) -> bool:
+    # Whether evaluating stmt on whole arrays gives the same items as evaluating it on every item:
+    # it only reads its locals and variables, and does arithmetic and comparisons
+    if type(stmt) == dict:
+        return all(k in vectorizable_commands and vectorizable(v) for k, v in stmt.items())
+    elif type(stmt) == list:
+        return all(vectorizable(x) for x in stmt)
+    return True
+
+def map_args(rt, args: List) -> Tuple[str, List, bool]:
+    # Returns the function name, the arrays, and whether the function can be called on the whole arrays
+    if len(args) < 2:
+        raise ArgumentMismathError(f'"map" expects at least 2 arguments, but got {len(args)}')
+    name, arrays = args[0], [to_array(x) for x in args[1:]]
+    function = rt.functions.get(name)
+    if function is None:
+        raise JsonLangRuntimeError(f'Unknown function "{name}"')
+    if any(len(x) != len(arrays[0]) for x in arrays):
+        raise JsonLangRuntimeError('"map" expects arrays of the same length')
+    vectorized = isinstance(function, runtime.PureFunction) and function.args is not None and \
+        len(function.args) == len(arrays) and vectorizable(function.function)
+    return name, arrays, vectorized
+
+def map_(rt, args: List) -> Any:
+    name, arrays, vectorized = map_args(rt, args)
+    if vectorized:
+        result = rt.invoke_function(name, arrays)
+        if is_array(result) and len(result) == len(arrays[0]):
+            return result
+    return to_array([rt.invoke_function(name, list(x)) for x in zip(*[items(a) for a in arrays])])
+
+def allocating(fn: Callable[[Any, List], Any]) -> Callable[[Any, List], Any]:
+    def run(rt, args: List) -> Any:
+        value = fn(rt, args)
+        if rt.budget is not None:
+            rt.budget.allocate(len(value))
+        return value
+    return run
+
+builtins = {
+    'array': allocating(array),
+    'list': allocating(to_list),
+    'sum': reduction('sum', sum),
+    'mean': reduction('mean', lambda x: sum(x) / len(x)),
+    'min': reduction('min', min),
+    'max': reduction('max', max),
+    'where': allocating(where),
+    'sort': allocating(sort),
+    'map': allocating(map_),
+}
@@ -0,0 +1,528 @@
+# async_compiler.py
+
+# Compiler for the async runtime (Runtime.run_async).
+# Statements that may suspend (calls, defs, and spawn/await/gather) are compiled
+# into coroutine closures, async def fn(rt, fr) -> value. Every subtree that
+# can't suspend is compiled by the synchronous Compiler and wrapped, so it runs
+# at the same speed as in the default engine.
+# Functions defined by async code are AsyncFunctions, calling them yields a
+# coroutine, as do the async builtins (sleep, read_file, http_get, map).
+#
+# {"spawn": {"call": ...}} evaluates the arguments and starts the call as a task,
+# {"spawn": expr} evaluates expr in a task, both yield the task.
+# {"await": expr} waits for the task (or any awaitable) that expr yields.
+# {"gather": [expr, ...]} evaluates the expressions concurrently and waits for
+# all of them, {"gather": expr} waits for all the tasks in the list expr yields.
+
+from typing import Any, List, Optional
+import urllib.request
+import inspect
+import asyncio
+
+from .errors import *
+from .compiler import Compiler, Operators, Return, Scope, Unit, Closure, const, fail
+
+from . import runtime
+from . import values
+from . import arrays
+
+def may_suspend(stmt: Any) -> bool:
+    if type(stmt) == dict:
+        for k, v in stmt.items():
+            if k in AsyncCompiler.suspending or may_suspend(v):
+                return True
+    elif type(stmt) == list:
+        return any(may_suspend(x) for x in stmt)
+    return False
+
+def wrap(fn: Closure) -> Closure:
+    async def run(rt, fr):
+        return fn(rt, fr)
+    return run
+
+def store(address, name: str, fn: Closure) -> Closure:
+    if address is None:
+        async def run(rt, fr):
+            rt.locals[name] = value = await fn(rt, fr)
+            return value
+        return run
+    depth, slot = address
+    async def run(rt, fr):
+        value = await fn(rt, fr)
+        for _ in range(depth):
+            fr = fr[0]
+        fr[slot] = value
+        return value
+    return run
+
+async def invoke(rt, name: str, args: List) -> Any:
+    ret = rt.invoke_function(name, args)
+    if inspect.isawaitable(ret):
+        ret = await ret
+    return ret
+
+async def complete(rt, ret: Return) -> Any:
+    # Like Runtime.complete, tail calls to async functions are made in this loop
+    while ret.__class__ is Return:
+        if ret.name is None:
+            return ret.value
+        function = rt.functions.get(ret.name)
+        if type(function) != AsyncFunction or function.cache is not None:
+            return await invoke(rt, ret.name, ret.value)
+        function.check_args(ret.value)
+        if rt.budget is not None:
+            rt.budget.step()
+        ret = await function.unit.body(rt, function.unit.frame(function.env, ret.value))
+    return ret
+
+def spawn(rt, coroutine) -> asyncio.Task:
+    task = asyncio.ensure_future(coroutine)
+    rt.tasks.add(task)
+    task.add_done_callback(rt.tasks.discard)
+    return task
+
+async def drain(rt):
+    # Waits for the spawned tasks that are still running, and the tasks they spawn
+    while len(rt.tasks) > 0:
+        await asyncio.gather(*rt.tasks)
+
+async def settle(values: List) -> List:
+    # Waits for the awaitables in values concurrently and replaces them with their results
+    pending = [i for i, x in enumerate(values) if inspect.isawaitable(x)]
+    if len(pending) > 0:
+        results = await asyncio.gather(*[values[i] for i in pending])
+        values = list(values)
+        for i, result in zip(pending, results):
+            values[i] = result
+    return values
+
+class AsyncFunction(runtime.Function):
+    def __call__(self, runtime, args: List) -> Any:
+        self.check_args(args)
+        return self.call(runtime, args)
+
+    async def call(self, runtime, args: List) -> Any:
+        budget = runtime.budget
+        if budget is not None:
+            # The calls of concurrent tasks all count for the depth
+            budget.step()
+            budget.enter()
+        try:
+            ret = await self.unit.body(runtime, self.unit.frame(self.env, args))
+            if ret.__class__ is Return:
+                return await complete(runtime, ret)
+            return ret
+        finally:
+            if budget is not None:
+                budget.exit()
+
+class AsyncPureFunction(AsyncFunction):
+    def __init__(self, args: List[str], function: Any, unit: Unit, env: List, name: str, cache_size: int):
+        super().__init__(args, function, unit, env, name)
+        self.cache = runtime.CallCache(cache_size)
+
+    async def call(self, rt, args: List) -> Any:
+        key = runtime.CallCache.key(args)
+        if key is None:
+            return await super().call(rt, args)
+        ret = self.cache.get(key)
+        if ret is runtime.CallCache.missing:
+            ret = await super().call(rt, args)
+            self.cache.put(key, ret)
+        return ret
+
+def read_text(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+def fetch(url: str) -> str:
+    with urllib.request.urlopen(url) as response:
+        return response.read().decode()
+
+async def sleep(rt, args: List):
+    await asyncio.sleep(args[0] if len(args) > 0 else 0)
+
+async def read_file(rt, args: List) -> str:
+    if len(args) != 1:
+        raise ArgumentMismathError(f'Expected 1 arguments, but got {len(args)}')
+    return await asyncio.to_thread(read_text, args[0])
+
+async def http_get(rt, args: List) -> str:
+    if len(args) != 1:
+        raise ArgumentMismathError(f'Expected 1 arguments, but got {len(args)}')
+    return await asyncio.to_thread(fetch, args[0])
+
+async def map_(rt, args: List) -> Any:
+    # arrays.map_ for functions that return coroutines
+    name, values, vectorized = arrays.map_args(rt, args)
+    if vectorized:
+        result = await invoke(rt, name, values)
+        if arrays.is_array(result) and len(result) == len(values[0]):
+            return result
+    return arrays.to_array([await invoke(rt, name, list(x)) for x in zip(*[arrays.items(a) for a in values])])
+
+builtins = {
+    'sleep': sleep,
+    'read_file': read_file,
+    'http_get': http_get,
+    'map': map_,
+}
+
+class AsyncCompiler(Compiler):
+    suspending = {'call', 'def', 'function', 'spawn', 'await', 'gather'}
+
+    def __init__(self):
+        super().__init__()
+        self.async_handlers = {
+            'print': self.async_print,
+            'local': self.async_local,
+            'set': self.async_set,
+            'set_local': self.async_set_local,
+            'if': self.async_if,
+            'for': self.async_for,
+            'while': self.async_while,
+            'switch': self.async_switch,
+            'def': self.async_def,
+            'function': self.async_def,
+            'call': self.async_call,
+            'return': self.async_return,
+            'spawn': self.async_spawn,
+            'await': self.async_await,
+            'gather': self.async_gather,
+        }
+        for cmd in list(Operators.binary) + list(Operators.logical) + list(Operators.aliases):
+            self.async_handlers[cmd] = self.async_operator
+        for cmd in values.ops:
+            self.async_handlers[cmd] = self.async_collection
+        self.handlers['parallel_for'] = self.compile_sync_only
+        self.handlers['pmap'] = self.compile_sync_only
+
+    def compile_program(self, code_block: Any, name: str = 'program') -> Unit:
+        unit = Unit([])
+        return self.compile_unit(unit, Scope(unit, shared=True), name, lambda: self.async_block(code_block))
+
+    def async_function(self, code_block: Any, args: Optional[List[str]], parent: Scope) -> Unit:
+        def compile_body():
+            self.declare_args(args)
+            return self.async_block(code_block)
+        unit = Unit(args)
+        return self.compile_unit(unit, Scope(unit, parent), None, compile_body)
+
+    def async_expr(self, stmt: Any) -> Closure:
+        if not may_suspend(stmt):
+            return wrap(self.compile_expr(stmt))
+        if type(stmt) == dict and len(stmt) == 1:
+            (k, v), = stmt.items()
+            return self.async_stmt(k, v)
+        fns = [self.async_stmt(k, v) for k, v in stmt.items()] if type(stmt) == dict else [self.async_expr(x) for x in stmt]
+        async def run(rt, fr):
+            values = []
+            for fn in fns:
+                value = await fn(rt, fr)
+                if value.__class__ is Return:
+                    return value
+                values.append(value)
+            return values
+        return run
+
+    def async_stmt(self, cmd: str, value: Any) -> Closure:
+        handler = self.async_handlers.get(cmd)
+        if handler is None or not may_suspend({cmd: value}):
+            return wrap(self.compile_stmt(cmd, value))
+        return handler(cmd, value)
+
+    def async_block(self, code_block: Any) -> Closure:
+        if not may_suspend(code_block):
+            return wrap(self.compile_block(code_block))
+        fns = []
+        self.__flatten_block(code_block, fns)
+        if len(fns) == 1:
+            return fns[0]
+        async def run(rt, fr):
+            ret = None
+            for fn in fns:
+                ret = await fn(rt, fr)
+                if ret.__class__ is Return:
+                    break
+            return ret
+        return run
+
+    def __flatten_block(self, code_block: Any, fns: List[Closure]):
+        if type(code_block) == dict:
+            for k, v in code_block.items():
+                fns.append(self.async_stmt(k, v))
+        elif type(code_block) == list:
+            for s in code_block:
+                start = len(fns)
+                self.__flatten_block(s, fns)
+                if len(fns) == start:
+                    fns.append(wrap(const(None)))
+        else:
+            fns.append(wrap(const(code_block)))
+
+    def async_print(self, cmd: str, value: Any) -> Closure:
+        fn = self.async_expr(value)
+        async def run(rt, fr):
+            rt.output.emit(await fn(rt, fr))
+        return run
+
+    def async_local(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict or 'name' not in value or 'value' not in value:
+            return wrap(self.compile_local(cmd, value))
+        name = value['name']
+        fn = self.async_expr(value['value'])
+        address = self.scope.resolve(name)
+        if address is not None:
+            return store(address, name, fn)
+        async def run(rt, fr):
+            value = await fn(rt, fr)
+            if name in rt.locals:
+                rt.locals[name] = value
+            return rt.locals.get(name)
+        return run
+
+    def async_set(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict or value.get('name', '') == '' or 'value' not in value:
+            return wrap(self.compile_set(cmd, value))
+        name = value['name']
+        fn = self.async_expr(value['value'])
+        async def run(rt, fr):
+            rt.variables[name] = value = await fn(rt, fr)
+            return value
+        return run
+
+    def async_set_local(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict or value.get('name', '') == '' or 'value' not in value:
+            return wrap(self.compile_set_local(cmd, value))
+        name = value['name']
+        fn = self.async_expr(value['value'])
+        slot = self.scope.declare(name)
+        if slot is None:
+            async def run(rt, fr):
+                rt.locals[name] = await fn(rt, fr)
+        else:
+            async def run(rt, fr):
+                fr[slot] = await fn(rt, fr)
+        return run
+
+    def async_if(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return wrap(self.compile_if(cmd, value))
+        def compile_body():
+            cond = self.async_expr(value.get('condition', ''))
+            then = self.async_expr(value.get('then', {}))
+            else_ = self.async_expr(value.get('else', {}))
+            async def run(rt, fr):
+                if await cond(rt, fr):
+                    return await then(rt, fr)
+                return await else_(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def async_for(self, cmd: str, value: Any) -> Closure:
+        for_range = value.get('range') if type(value) == dict else None
+        if type(for_range) == dict and 'var' in for_range and ('in' in for_range or 'to' in for_range):
+            return self.__async_range_for(for_range, value.get('code'))
+        if type(for_range) != list or len(for_range) != 3:
+            return wrap(self.compile_for(cmd, value))
+        def compile_body():
+            init, cond, step = [self.async_expr(x) for x in for_range]
+            body = self.async_block(value.get('code'))
+            async def run(rt, fr):
+                await init(rt, fr)
+                budget = rt.budget
+                while await cond(rt, fr):
+                    if budget is not None:
+                        budget.step()
+                    ret = await body(rt, fr)
+                    if ret.__class__ is Return:
+                        return ret
+                    await step(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def __async_range_for(self, for_range: dict, code: Any) -> Closure:
+        def compile_body():
+            if 'in' in for_range:
+                items = self.async_expr(for_range['in'])
+            else:
+                start = self.async_expr(for_range.get('from', 0))
+                stop = self.async_expr(for_range['to'])
+                step = self.async_expr(for_range.get('step', 1))
+                async def items(rt, fr):
+                    return range(await start(rt, fr), await stop(rt, fr), await step(rt, fr))
+            slot = self.scope.declare(for_range['var'])
+            body = self.async_block(code)
+            async def run(rt, fr):
+                budget = rt.budget
+                for fr[slot] in await items(rt, fr):
+                    if budget is not None:
+                        budget.step()
+                    ret = await body(rt, fr)
+                    if ret.__class__ is Return:
+                        return ret
+            return run
+        return self.scoped(compile_body)
+
+    def async_while(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return wrap(self.compile_while(cmd, value))
+        def compile_body():
+            cond = self.async_expr(value.get('condition'))
+            body = self.async_block(value.get('code'))
+            async def run(rt, fr):
+                budget = rt.budget
+                while await cond(rt, fr):
+                    if budget is not None:
+                        budget.step()
+                    ret = await body(rt, fr)
+                    if ret.__class__ is Return:
+                        return ret
+            return run
+        return self.scoped(compile_body)
+
+    def async_switch(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return wrap(self.compile_switch(cmd, value))
+        def compile_body():
+            switch_value = self.async_expr(value['value']) if 'value' in value else wrap(const(None))
+            cases = {k: self.async_block(v) for k, v in value.get('case', {}).items()}
+            default = cases.get(runtime.Constants.wildcard_symbol)
+            async def run(rt, fr):
+                case = cases.get(str(await switch_value(rt, fr)), default)
+                if case is not None:
+                    ret = await case(rt, fr)
+                    if ret.__class__ is Return:
+                        return ret
+            return run
+        return self.scoped(compile_body)
+
+    def async_def(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict or value.get('name', '') == '':
+            return wrap(self.compile_def(cmd, value))
+        name = value['name']
+        args = value.get('args', [])
+        code = value.get('code', {})
+        unit = self.async_function(code, args, self.scope)
+        if value.get('pure', False):
+            try:
+                cache_size = runtime.PureFunction.check_options(value)
+            except InvalidArgumentsError as ex:
+                return wrap(fail(ex))
+            async def run(rt, fr):
+                rt.functions[name] = AsyncPureFunction(args, code, unit, fr, name, cache_size)
+        else:
+            async def run(rt, fr):
+                rt.functions[name] = AsyncFunction(args, code, unit, fr, name)
+        return run
+
+    def async_call(self, cmd: str, value: Any) -> Closure:
+        call = self.compile_call_args(value, self.async_expr)
+        if call is None:
+            return wrap(self.compile_call(cmd, value))
+        name, args = call
+        async def run(rt, fr):
+            return await invoke(rt, name, [await arg(rt, fr) for arg in args])
+        return run
+
+    def async_return(self, cmd: str, value: Any) -> Closure:
+        if type(value) == dict and len(value) == 1 and 'call' in value:
+            call = self.compile_call_args(value['call'], self.async_expr)
+            if call is not None:
+                name, args = call
+                async def run(rt, fr):
+                    return Return([await arg(rt, fr) for arg in args], name)
+                return run
+        fn = self.async_expr(value)
+        async def run(rt, fr):
+            return Return(await fn(rt, fr))
+        return run
+
+    def async_spawn(self, cmd: str, value: Any) -> Closure:
+        call = None
+        if type(value) == dict and len(value) == 1 and 'call' in value:
+            call = self.compile_call_args(value['call'], self.async_expr)
+        if call is not None:
+            name, args = call
+            async def run(rt, fr):
+                return spawn(rt, invoke(rt, name, [await arg(rt, fr) for arg in args]))
+        else:
+            fn = self.async_expr(value)
+            async def run(rt, fr):
+                return spawn(rt, fn(rt, fr))
+        return run
+
+    def async_await(self, cmd: str, value: Any) -> Closure:
+        fn = self.async_expr(value)
+        async def run(rt, fr):
+            ret = await fn(rt, fr)
+            if inspect.isawaitable(ret):
+                ret = await ret
+            return ret
+        return run
+
+    def async_gather(self, cmd: str, value: Any) -> Closure:
+        if type(value) == list:
+            fns = [self.async_expr(x) for x in value]
+            async def run(rt, fr):
+                return await settle(await asyncio.gather(*[fn(rt, fr) for fn in fns]))
+            return run
+        fn = self.async_expr(value)
+        async def run(rt, fr):
+            values = await fn(rt, fr)
+            if type(values) != list:
+                raise JsonLangRuntimeError('"gather" expects a list')
+            return await settle(values)
+        return run
+
+    def async_operator(self, cmd: str, value: Any) -> Closure:
+        symbol = Operators.symbol(cmd)
+        if type(value) != list or (len(value) == 0 and symbol not in Operators.logical):
+            return wrap(self.compile_operator(cmd, value))
+        fns = [self.async_expr(x) for x in value]
+        if symbol in Operators.logical:
+            # && stops at the first falsy operand, || at the first truthy one
+            stop = symbol == '||'
+            async def run(rt, fr):
+                ret = not stop
+                for fn in fns:
+                    ret = await fn(rt, fr)
+                    if bool(ret) == stop:
+                        break
+                return ret
+            return run
+        if symbol in Operators.comparisons:
+            # Operands are evaluated in order, up to the first comparison that is false
+            op = Operators.binary[symbol]
+            first, rest = fns[0], fns[1:]
+            async def run(rt, fr):
+                left, result = await first(rt, fr), True
+                for fn in rest:
+                    right = await fn(rt, fr)
+                    result = arrays.compare_pair(op, result, left, right)
+                    if result is False:
+                        return False
+                    left = right
+                return result
+            return run
+        allocates = self.metered and symbol in Operators.allocating
+        async def run(rt, fr):
+            value = Operators.evaluate(symbol, [await fn(rt, fr) for fn in fns])
+            if allocates and rt.budget is not None:
+                rt.budget.allocate(values.size(value))
+            return value
+        return run
+
+    def async_collection(self, cmd: str, value: Any) -> Closure:
+        op = values.ops[cmd]
+        fns = [self.async_expr(x) for x in values.operands(value)]
+        try:
+            op.check_args(len(fns))
+        except ArgumentMismathError as ex:
+            return wrap(fail(ex))
+        async def run(rt, fr):
+            return op(rt, [await f(rt, fr) for f in fns])
+        return run
+
+    def compile_sync_only(self, cmd: str, value: Any) -> Closure:
+        return fail(JsonLangRuntimeError(f'"{cmd}" isn\'t supported by the async runtime, "gather" runs calls concurrently'))
@@ -0,0 +1,144 @@
+# batch.py
+
+# Runs many independent jobs (programs, or one program over many sets of input
+# variables) on a process pool. Every worker parses and compiles a program once
+# and keeps it for all of its jobs, each job gets a fresh Runtime so jobs don't
+# see each other's state. The output of a job is captured and handed back with
+# its result, results come back in the order of the jobs.
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, IO, Iterator, List, Optional
+import copy
+import json
+import time
+import os
+
+from .errors import ParseError
+from .output import CaptureOutput, Output
+from .limits import Limits
+from .cache import ProgramCache
+from .parser import Parser
+from .code import Code
+
+from . import runtime
+
+class Job:
+    def __init__(self, index: int, path: str, variables: Optional[Dict] = None, label: str = None):
+        self.index = index
+        self.path = path
+        self.variables = variables
+        self.label = label or path
+
+class JobResult:
+    def __init__(self, index: int, label: str, output: str, error: Optional[str], elapsed: float):
+        self.index = index
+        self.label = label
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+
+class Worker:
+    def __init__(self, engine: str, optimize: bool, records: bool = False, limits: Optional[Limits] = None):
+        self.engine = engine
+        self.optimize = optimize
+        self.records = records
+        self.limits = limits
+        self.programs = {}
+
+    def program(self, path: str) -> Code:
+        code = self.programs.get(path)
+        if code is None:
+            code = self.programs[path] = Parser.parse_file(path)
+            code.path = os.path.realpath(path)
+        return code
+
+    def run(self, job: Job) -> JobResult:
+        out = CaptureOutput(self.records)
+        error = None
+        start = time.perf_counter()
+        try:
+            code = self.program(job.path)
+            if job.variables is not None:
+                # The copy shares the compiled program, only its variables are replaced
+                code = copy.copy(code)
+                code.variables = dict(code.variables, **job.variables)
+            rt = runtime.Runtime(self.engine, self.optimize)
+            rt.output = out
+            rt.set_limits(self.limits)
+            rt.add_program(code)
+            rt.run_program(code.name)
+            self.programs[job.path].compiled = code.compiled
+        except Exception as ex:
+            error = f'{ex.__class__.__name__}: {ex}'
+        return JobResult(job.index, job.label, out.getvalue(), error, time.perf_counter() - start)
+
+worker = None
+
+def init_worker(engine: str, optimize: bool, cache_enabled: bool, cache_directory: Optional[str], tier_threshold: int, records: bool,
+                limits: Optional[Limits]):
+    global worker
+    ProgramCache.enabled = cache_enabled
+    ProgramCache.directory = cache_directory
+    runtime.Constants.tier_threshold = tier_threshold
+    worker = Worker(engine, optimize, records, limits)
+
+def run_job(job: Job) -> JobResult:
+    return worker.run(job)
+
+def read_inputs(path: str, program: str) -> List[Job]:
+    # Every line of a JSONL file is an object of variables for one run of the program
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip() == '':
+                continue
+            try:
+                variables = json.loads(line)
+            except json.JSONDecodeError as ex:
+                raise ParseError(f'{path}:{line_no}: {ex}')
+            if type(variables) != dict:
+                raise ParseError(f'{path}:{line_no}: expected an object of variables')
+            jobs.append(Job(len(jobs), program, variables, f'{program} ({path}:{line_no})'))
+    return jobs
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))]
+
+class Batch:
+    def __init__(self, jobs: List[Job], workers: Optional[int] = None, engine: str = 'compiled', optimize: bool = True,
+                 limits: Optional[Limits] = None):
+        self.jobs = jobs
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self.optimize = optimize
+        self.limits = limits
+
+    def results(self, records: bool) -> Iterator[JobResult]:
+        initargs = (self.engine, self.optimize, ProgramCache.enabled, ProgramCache.directory, runtime.Constants.tier_threshold, records, self.limits)
+        if self.workers == 1:
+            init_worker(*initargs)
+            yield from map(run_job, self.jobs)
+            return
+        # Several jobs per task keep the overhead of sending them to the workers low
+        chunksize = max(1, len(self.jobs) // (self.workers * 4))
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=initargs) as pool:
+            yield from pool.map(run_job, self.jobs, chunksize=chunksize)
+
+    def run(self, out: Output, err: IO) -> bool:
+        # Writes the output of every job in order and a summary, returns whether all jobs succeeded
+        start = time.perf_counter()
+        latencies, failures = [], 0
+        for result in self.results(out.records):
+            out.write(result.output)
+            latencies.append(result.elapsed)
+            if result.error is not None:
+                failures += 1
+                err.write(f'job {result.index} ({result.label}) failed: {result.error}\n')
+        out.flush()
+        wall = time.perf_counter() - start
+        err.write(f'{len(self.jobs)} jobs, {failures} failed, {self.workers} workers, {wall:.3f}s wall time\n')
+        if len(latencies) > 0:
+            err.write(f'job latency: p50 {percentile(latencies, 50) * 1000:.3f}ms, p90 {percentile(latencies, 90) * 1000:.3f}ms, '
+                      f'max {max(latencies) * 1000:.3f}ms\n')
+        return failures == 0
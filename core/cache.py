@@ -0,0 +1,129 @@
+# cache.py
+
+# On-disk cache of parsed programs (.jlc files).
+# A cache file holds a header with the mtime, size and sha256 of the source file
+# it was made from, followed by the program in marshal format, which loads
+# much faster than JSON. The cache is trusted while the mtime and size of the
+# source match, otherwise the source is hashed, and only parsed again when
+# its content actually changed.
+# Cache files are written next to their sources, or into ProgramCache.directory
+# (JSONLANG_CACHE_DIR) when it is set.
+
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Tuple
+import hashlib
+import marshal
+import struct
+import mmap
+import json
+import gc
+import os
+
+from .errors import ParseError
+
+@contextmanager
+def gc_paused():
+    # Unpacking a large program creates millions of containers,
+    # which would otherwise trigger full garbage collections along the way
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+class ProgramCache:
+    extension = '.jlc'
+    magic = b'JLC' + bytes([marshal.version])
+    header = struct.Struct('<4sqq32s')
+    enabled = True
+    directory = os.environ.get('JSONLANG_CACHE_DIR')
+
+    @staticmethod
+    def cache_path(path: str) -> str:
+        base = os.path.splitext(path)[0]
+        if ProgramCache.directory is None:
+            return base + ProgramCache.extension
+        key = hashlib.sha256(path.encode()).hexdigest()[:16]
+        return os.path.join(ProgramCache.directory, f'{os.path.basename(base)}-{key}{ProgramCache.extension}')
+
+    @staticmethod
+    def load(path: str) -> Tuple[Tuple[int, int], str, Any]:
+        # Returns the (mtime, size) and sha256 of the source, and its parsed JSON
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        stat = st.st_mtime_ns, st.st_size
+        cached = ProgramCache.__read(path) if ProgramCache.enabled else None
+        try:
+            if cached is not None and cached[0] == stat:
+                return stat, cached[1], cached[2]()
+
+            with open(path, 'rb') as f:
+                data = f.read()
+                st = os.fstat(f.fileno())
+            stat = st.st_mtime_ns, st.st_size
+            digest = hashlib.sha256(data).hexdigest()
+            if cached is not None and cached[1] == digest:
+                # Only the mtime changed, the header is updated in place
+                ProgramCache.__write_header(path, stat, digest)
+                return stat, digest, cached[2]()
+        finally:
+            # The cache file stays mapped until the payload was loaded or turned out to be stale
+            if cached is not None:
+                cached[3].close()
+        try:
+            with gc_paused():
+                program = json.loads(data)
+        except Exception as e:
+            raise ParseError(f'{path}: {e}')
+        if ProgramCache.enabled:
+            ProgramCache.__write(path, stat, digest, program)
+        return stat, digest, program
+
+    @staticmethod
+    def __read(path: str) -> Optional[Tuple[Tuple[int, int], str, Callable[[], Any], mmap.mmap]]:
+        # The payload is returned as a thunk, so it's only unmarshalled when the header is valid,
+        # the caller closes the mapping
+        try:
+            with open(ProgramCache.cache_path(path), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mm) < ProgramCache.header.size:
+            mm.close()
+            return None
+        magic, mtime, size, digest = ProgramCache.header.unpack_from(mm)
+        if magic != ProgramCache.magic:
+            mm.close()
+            return None
+        def payload():
+            with memoryview(mm) as view, view[ProgramCache.header.size:] as payload_view, gc_paused():
+                return marshal.loads(payload_view)
+        return (mtime, size), digest.hex(), payload, mm
+
+    @staticmethod
+    def __write_header(path: str, stat: Tuple[int, int], digest: str):
+        try:
+            with open(ProgramCache.cache_path(path), 'r+b') as f:
+                f.write(ProgramCache.header.pack(ProgramCache.magic, stat[0], stat[1], bytes.fromhex(digest)))
+        except OSError:
+            pass
+
+    @staticmethod
+    def __write(path: str, stat: Tuple[int, int], digest: str, program: Any):
+        cache_path = ProgramCache.cache_path(path)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            if ProgramCache.directory is not None:
+                os.makedirs(ProgramCache.directory, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(ProgramCache.header.pack(ProgramCache.magic, stat[0], stat[1], bytes.fromhex(digest)))
+                marshal.dump(program, f)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError):
+            # The cache is best effort, a read-only source directory just disables it
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
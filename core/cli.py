@@ -1,7 +1,8 @@
 # cli.py
 
-from .errors import UnknownCommandError
+from .errors import UnknownCommandError, ArgumentMismathError
 from .parser import Parser
+from .image import Image
 
 from . import runtime
 
@@ -31,6 +32,7 @@ class Repl:
             'debug': False
         }
         self.rt = runtime.Runtime()
+        self.snapshot = None
 
     def set_runtime(self, rt):
         self.rt = rt
@@ -53,9 +55,31 @@ class Repl:
                     elif tokens[0] == 'help':
                         print('JsonLang v' + self.env['version'])
                         print('Interpreter for JsonLang. Type json to execute it')
-                        print('Available commands: quit help reset env var locals func list load run-prog run-func')
+                        print('Available commands: quit help reset snapshot restore image env var locals func list load run-prog run-func profile')
+                    elif tokens[0] == 'reset' and len(tokens) == 2 and tokens[1] == 'caches':
+                        self.rt.clear_caches()
                     elif tokens[0] == 'reset':
-                        self.rt = runtime.Runtime()
+                        # Only the state goes, the settings of the runtime (and its limits) stay
+                        old = self.rt
+                        self.rt = runtime.Runtime(old.engine, old.optimizer is not None)
+                        self.rt.output = old.output
+                        self.rt.tier_threshold = old.tier_threshold
+                        self.rt.set_limits(old.limits)
+                        if old.profiler is not None:
+                            self.rt.enable_profiler(old.profiler)
+                    elif tokens[0] == 'snapshot':
+                        self.snapshot = self.rt.snapshot()
+                    elif tokens[0] == 'restore':
+                        if self.snapshot is None:
+                            raise ArgumentMismathError('no snapshot was taken')
+                        self.rt.restore(self.snapshot)
+                    elif tokens[0] == 'image':
+                        if len(tokens) == 3 and tokens[1] == 'save':
+                            Image.save(self.rt, tokens[2])
+                        elif len(tokens) == 3 and tokens[1] == 'load':
+                            Image.load(self.rt, tokens[2])
+                        else:
+                            raise ArgumentMismathError('usage: image save|load FILE')
                     elif tokens[0] == 'env':
                         if len(tokens) > 1:
                             if tokens[1] == 'get':
@@ -82,14 +106,16 @@ class Repl:
                             if tokens[1] == 'get':
                                 print('{}: {}'.format(tokens[2], self.rt.variables[tokens[2]]))
                             elif tokens[1] == 'set':
-                                self.rt.variables[tokens[2]] = self.rt.parse_expr(Parser.parse_json(' '.join(tokens[3:])))
+                                self.rt.variables[tokens[2]] = self.rt.eval_expr(Parser.parse_json(' '.join(tokens[3:])))
                         else:
                             raise ArgumentMismathError('usage: var [get|set KEY [VALUE]]')
                     elif tokens[0] == 'locals':
                         print(self.rt.locals)
                     elif tokens[0] == 'func':
                         for k, v in self.rt.functions.items():
-                            print('{}({}): {}'.format(k, ' '.join(v.args) if type(v) == runtime.Function else '...', v))
+                            print('{}({}): {}'.format(k, ' '.join(v.args) if isinstance(v, runtime.Function) else '...', v))
+                            if isinstance(v, runtime.Function) and v.cache is not None:
+                                print(f'  cache: {v.cache}')
                     elif tokens[0] == 'list':
                         for k, v in self.rt.programs.items():
                             print(f'{k}: {v}')
@@ -99,9 +125,23 @@ class Repl:
                     elif tokens[0] == 'run-prog':
                         if len(tokens) > 1:
                             self.rt.run_program(' '.join(tokens[1:]))
+                    elif tokens[0] == 'profile':
+                        if len(tokens) == 2 and tokens[1] == 'on':
+                            self.rt.enable_profiler()
+                        elif len(tokens) == 2 and tokens[1] == 'off':
+                            self.rt.disable_profiler()
+                        elif len(tokens) == 2 and tokens[1] == 'reset' and self.rt.profiler is not None:
+                            self.rt.profiler.reset()
+                        elif len(tokens) == 2 and tokens[1] == 'report' and self.rt.profiler is not None:
+                            self.rt.profiler.report(sys.stdout)
+                        elif len(tokens) == 3 and tokens[1] == 'collapsed' and self.rt.profiler is not None:
+                            with open(tokens[2], 'w') as f:
+                                self.rt.profiler.write_collapsed(f)
+                        else:
+                            raise ArgumentMismathError('usage: profile on|off|reset|report|collapsed FILE (profiling has to be on)')
                     elif tokens[0] == 'run-func':
                         if len(tokens) > 1:
-                            self.rt.invoke_function(tokens[1], [self.rt.parse_expr(x) for x in tokens[2:]])
+                            self.rt.invoke_function(tokens[1], [self.rt.eval_expr(x) for x in tokens[2:]])
                     else:
                         self.rt.run_stmt(Parser.parse_json(inp))
 
@@ -117,3 +157,5 @@ class Repl:
 
                 if self.env['debug']:
                     traceback.print_exc()
+            finally:
+                self.rt.output.flush()
@@ -63,7 +63,12 @@ class Code:
         self.imports = imports
         self.variables = variables
         self.code = code
-    
+        self.compiled = None
+        self.path = None
+
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, compiled=None)
+
     @staticmethod
     def from_json(json): # -> Code
         program_name = json['program'] if 'program' in json else 'program'
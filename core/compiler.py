@@ -0,0 +1,900 @@
+# compiler.py
+
+# Turns JsonLang statements into a tree of pre-bound closures.
+# Every closure has the signature fn(rt, fr) -> value, so the opcode dispatch and
+# the JSON shape inspection happen once, at compile time, instead of on every
+# evaluation like in Runtime.parse_stmt (which is kept as the reference walker).
+#
+# Local variables are resolved while compiling. Every function body (and every
+# program) is a Unit that runs in one frame: a list holding the frame of the
+# enclosing function at index 0 and one slot per local name after it.
+# Blocks (if, for, while, switch) don't get frames of their own, their names
+# get separate slots in the frame of the unit they belong to.
+# Locals declared at the top level of a program live in Runtime.locals, which
+# persists across programs and REPL statements, as do names that don't resolve.
+#
+# A return doesn't raise, it evaluates to a Return signal, which every closure that
+# runs a block containing a return passes on instead of continuing, up to the
+# function call that unwraps it (Runtime.complete). A return of a call is a tail
+# call: its arguments travel in the signal and the call is made by the caller's
+# loop, so tail recursion doesn't grow the Python stack.
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from functools import reduce
+import operator
+
+from .errors import *
+
+from . import runtime
+from . import values
+from . import arrays
+from . import parallel
+
+Closure = Callable[[Any, List], Any]
+
+class Return:
+    __slots__ = ('value', 'name')
+
+    def __init__(self, value: Any, name: Optional[str] = None):
+        # For a tail call, name is the function to call and value its arguments
+        self.value = value
+        self.name = name
+
+def has_return(stmt: Any) -> bool:
+    # Whether stmt contains a return outside of the functions it defines
+    if type(stmt) == dict:
+        for k, v in stmt.items():
+            if k == 'return' or (k not in ['def', 'function'] and has_return(v)):
+                return True
+    elif type(stmt) == list:
+        return any(has_return(x) for x in stmt)
+    return False
+
+class Unit:
+    def __init__(self, args: Optional[List[str]]):
+        self.args = args
+        self.size = 1
+        self.body = None
+        self.padding = []
+        # Needed to compile the unit again, with or without profiling
+        self.parent = None
+        self.profiler = None
+        self.metered = False
+
+    def __getstate__(self) -> Dict:
+        # Units are pickled with the scopes of functions in images, only to resolve names again
+        return dict(self.__dict__, body=None, profiler=None)
+
+    def allocate(self) -> int:
+        slot = self.size
+        self.size += 1
+        return slot
+
+    def finish(self, body: Closure):
+        # The body yields a Return signal when the code returns
+        self.body = body
+        bound = 1 if self.args is None else len(self.args)
+        self.padding = [None] * (self.size - 1 - bound)
+
+    def frame(self, env: Optional[List], args: List) -> List:
+        if self.args is None:
+            return [env, args] + self.padding
+        return [env] + args + self.padding
+
+    def run(self, rt, env: Optional[List] = None) -> Any:
+        ret = self.body(rt, self.frame(env, []))
+        if ret.__class__ is Return:
+            return rt.complete(ret)
+        return ret
+
+class Definition:
+    # A def doesn't compile its function with the code around it, the function is
+    # compiled when it's first called. The unit is kept here, for the functions
+    # later runs of the def make. The scope is a copy of the names visible at the def,
+    # so locals declared after it don't change what the function's names resolve to.
+    def __init__(self, scope: 'Scope'):
+        self.scope = scope.visible()
+        self.unit = None
+
+class Scope:
+    def __init__(self, unit: Unit, parent: 'Scope' = None, shared: bool = False):
+        # Names of a shared scope (the top level of a program) live in Runtime.locals
+        self.unit = unit
+        self.parent = parent
+        self.shared = shared
+        self.names = {}
+
+    def declare(self, name: str) -> Optional[int]:
+        if self.shared:
+            return None
+        if name not in self.names:
+            self.names[name] = self.unit.allocate()
+        return self.names[name]
+
+    def visible(self) -> 'Scope':
+        # The scopes as they are now, names declared later are only added to the originals
+        if self.shared:
+            return self
+        scope = Scope(self.unit, self.parent.visible() if self.parent is not None else None)
+        scope.names = dict(self.names)
+        return scope
+
+    def resolve(self, name: str) -> Optional[Tuple[int, int]]:
+        depth, scope = 0, self
+        while scope is not None and not scope.shared:
+            if name in scope.names:
+                return depth, scope.names[name]
+            if scope.parent is not None and scope.parent.unit is not scope.unit:
+                depth += 1
+            scope = scope.parent
+        return None
+
+# Metered code (compiled for a runtime with limits) charges the size of the strings
+# and lists + and * build to the budget
+
+def add_pair(a: Closure, b: Closure) -> Closure:
+    def run(rt, fr):
+        value = a(rt, fr) + b(rt, fr)
+        if rt.budget is not None:
+            rt.budget.allocate(values.size(value))
+        return value
+    return run
+
+def mul_pair(a: Closure, b: Closure) -> Closure:
+    def run(rt, fr):
+        value = a(rt, fr) * b(rt, fr)
+        if rt.budget is not None:
+            rt.budget.allocate(values.size(value))
+        return value
+    return run
+
+def add_const(a: Closure, c: Any) -> Closure:
+    def run(rt, fr):
+        value = a(rt, fr) + c
+        if rt.budget is not None:
+            rt.budget.allocate(values.size(value))
+        return value
+    return run
+
+def mul_const(a: Closure, c: Any) -> Closure:
+    def run(rt, fr):
+        value = a(rt, fr) * c
+        if rt.budget is not None:
+            rt.budget.allocate(values.size(value))
+        return value
+    return run
+
+class Operators:
+    binary = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.truediv,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<': operator.lt,
+        '>': operator.gt,
+    }
+
+    comparisons = {'==', '!=', '<', '>'}
+    logical = {'&&', '||'}
+    allocating = {'+', '*'}
+
+    aliases = {
+        'add': '+',
+        'sub': '-',
+        'mul': '*',
+        'div': '/',
+        'eq': '==',
+        'ne': '!=',
+        'lt': '<',
+        'gt': '>',
+        'and': '&&',
+        'or': '||',
+    }
+
+    # Evaluators for two operands, and for a constant right operand,
+    # which don't build an operand list for reduce()
+    pairs = {
+        '+': lambda a, b: lambda rt, fr: a(rt, fr) + b(rt, fr),
+        '-': lambda a, b: lambda rt, fr: a(rt, fr) - b(rt, fr),
+        '*': lambda a, b: lambda rt, fr: a(rt, fr) * b(rt, fr),
+        '/': lambda a, b: lambda rt, fr: a(rt, fr) / b(rt, fr),
+        '==': lambda a, b: lambda rt, fr: a(rt, fr) == b(rt, fr),
+        '!=': lambda a, b: lambda rt, fr: a(rt, fr) != b(rt, fr),
+        '<': lambda a, b: lambda rt, fr: a(rt, fr) < b(rt, fr),
+        '>': lambda a, b: lambda rt, fr: a(rt, fr) > b(rt, fr),
+        '&&': lambda a, b: lambda rt, fr: a(rt, fr) and b(rt, fr),
+        '||': lambda a, b: lambda rt, fr: a(rt, fr) or b(rt, fr),
+    }
+
+    const_pairs = {
+        '+': lambda a, c: lambda rt, fr: a(rt, fr) + c,
+        '-': lambda a, c: lambda rt, fr: a(rt, fr) - c,
+        '*': lambda a, c: lambda rt, fr: a(rt, fr) * c,
+        '/': lambda a, c: lambda rt, fr: a(rt, fr) / c,
+        '==': lambda a, c: lambda rt, fr: a(rt, fr) == c,
+        '!=': lambda a, c: lambda rt, fr: a(rt, fr) != c,
+        '<': lambda a, c: lambda rt, fr: a(rt, fr) < c,
+        '>': lambda a, c: lambda rt, fr: a(rt, fr) > c,
+    }
+
+    metered_pairs = {'+': add_pair, '*': mul_pair}
+    metered_const_pairs = {'+': add_const, '*': mul_const}
+
+    @staticmethod
+    def symbol(cmd: str) -> str:
+        return Operators.aliases.get(cmd, cmd)
+
+    @staticmethod
+    def evaluate(symbol: str, operands: List[Any]) -> Any:
+        # Operator semantics over evaluated operands, lazy evaluation gives the same results:
+        # arithmetic is applied left to right, comparisons are chained (a < b < c is
+        # a < b && b < c), && yields the first falsy operand or the last one, || the first
+        # truthy operand or the last one
+        if symbol == '&&':
+            ret = True
+            for x in operands:
+                ret = x
+                if not ret:
+                    break
+            return ret
+        if symbol == '||':
+            ret = False
+            for x in operands:
+                ret = x
+                if ret:
+                    break
+            return ret
+        op = Operators.binary[symbol]
+        if symbol in Operators.comparisons:
+            return arrays.compare(op, operands[0], iter(operands[1:]))
+        return reduce(op, operands)
+
+def const(value: Any) -> Closure:
+    return lambda rt, fr: value
+
+def fail(error: Exception) -> Closure:
+    # Errors in the program shape are raised when the statement is executed,
+    # not when it is compiled, to match the behaviour of the tree walker.
+    def run(rt, fr):
+        raise error
+    return run
+
+def sequence(fns: List[Closure], returns: bool = False) -> Closure:
+    if len(fns) == 0:
+        return const(None)
+    if len(fns) == 1:
+        return fns[0]
+    if returns:
+        def run(rt, fr):
+            ret = None
+            for fn in fns:
+                ret = fn(rt, fr)
+                if ret.__class__ is Return:
+                    break
+            return ret
+        return run
+    def run(rt, fr):
+        ret = None
+        for fn in fns:
+            ret = fn(rt, fr)
+        return ret
+    return run
+
+def collect(fns: List[Closure], returns: bool = False) -> Closure:
+    # Evaluates fns into a list, a return stops and yields its signal instead
+    if returns:
+        def run(rt, fr):
+            values = []
+            for fn in fns:
+                value = fn(rt, fr)
+                if value.__class__ is Return:
+                    return value
+                values.append(value)
+            return values
+        return run
+    return lambda rt, fr: [fn(rt, fr) for fn in fns]
+
+def load(address: Optional[Tuple[int, int]], name: str) -> Closure:
+    if address is None:
+        return lambda rt, fr: rt.locals.get(name)
+    depth, slot = address
+    if depth == 0:
+        return lambda rt, fr: fr[slot]
+    if depth == 1:
+        return lambda rt, fr: fr[0][slot]
+    def run(rt, fr):
+        for _ in range(depth):
+            fr = fr[0]
+        return fr[slot]
+    return run
+
+def store(address: Optional[Tuple[int, int]], name: str, fn: Closure) -> Closure:
+    if address is None:
+        def run(rt, fr):
+            rt.locals[name] = value = fn(rt, fr)
+            return value
+        return run
+    depth, slot = address
+    if depth == 0:
+        def run(rt, fr):
+            fr[slot] = value = fn(rt, fr)
+            return value
+        return run
+    def run(rt, fr):
+        value = fn(rt, fr)
+        for _ in range(depth):
+            fr = fr[0]
+        fr[slot] = value
+        return value
+    return run
+
+class Compiler:
+    def __init__(self):
+        self.scope = None
+        self.profiler = None
+        # Whether the code charges what it allocates to the budget of the runtime
+        self.metered = False
+        self.path = []
+        self.handlers = {
+            'comment': self.compile_comment,
+            'ignore': self.compile_comment,
+            'python': self.compile_python,
+            'py': self.compile_python,
+            'print': self.compile_print,
+            'var': self.compile_var,
+            'local': self.compile_local,
+            'set': self.compile_set,
+            'set_local': self.compile_set_local,
+            'if': self.compile_if,
+            'for': self.compile_for,
+            'while': self.compile_while,
+            'switch': self.compile_switch,
+            'def': self.compile_def,
+            'function': self.compile_def,
+            'call': self.compile_call,
+            'return': self.compile_return,
+            'import': self.compile_import,
+            'breakpoint': self.compile_breakpoint,
+            'spawn': self.compile_async_only,
+            'await': self.compile_async_only,
+            'gather': self.compile_async_only,
+            'parallel_for': self.compile_parallel_for,
+            'pmap': self.compile_pmap,
+        }
+        for cmd in list(Operators.binary) + list(Operators.logical) + list(Operators.aliases):
+            self.handlers[cmd] = self.compile_operator
+        for cmd in values.ops:
+            self.handlers[cmd] = self.compile_collection
+
+    def compile_program(self, code_block: Any, name: str = 'program') -> Unit:
+        unit = Unit([])
+        return self.compile_unit(unit, Scope(unit, shared=True), name, lambda: self.compile_block(code_block))
+
+    def compile_expression(self, stmt: Any, name: str = 'expression') -> Unit:
+        unit = Unit([])
+        return self.compile_unit(unit, Scope(unit, shared=True), name, lambda: self.compile_expr(stmt))
+
+    def compile_function(self, code_block: Any, args: Optional[List[str]], parent: Scope = None, name: str = None) -> Unit:
+        # Functions compiled as part of a def continue its location unless a name is given
+        def compile_body():
+            self.declare_args(args)
+            return self.compile_block(code_block)
+        unit = Unit(args)
+        return self.compile_unit(unit, Scope(unit, parent), name, compile_body)
+
+    def declare_args(self, args: Optional[List[str]]):
+        if args is None:
+            self.scope.declare('__args__')
+        else:
+            for arg in args:
+                self.scope.declare(arg)
+
+    def compile_unit(self, unit: Unit, scope: Scope, name: Optional[str], compile_body: Callable[[], Closure]) -> Unit:
+        outer, self.scope = self.scope, scope
+        outer_path = self.path
+        if name is not None:
+            self.path = [name]
+        try:
+            body = compile_body()
+        finally:
+            self.scope = outer
+            self.path = outer_path
+        unit.finish(body)
+        unit.parent = scope.parent
+        unit.profiler = self.profiler
+        unit.metered = self.metered
+        return unit
+
+    def __compile_scoped(self, compile_body: Callable[[], Closure]) -> Tuple[Closure, List[int]]:
+        # Compiles a block in a new scope, returns the slots it binds,
+        # which have to be cleared every time the block is entered.
+        outer = self.scope
+        self.scope = Scope(outer.unit, outer)
+        try:
+            body = compile_body()
+            slots = list(self.scope.names.values())
+        finally:
+            self.scope = outer
+        return body, slots
+
+    def compile_expr(self, stmt: Any) -> Closure:
+        if type(stmt) == dict:
+            fns = [self.compile_stmt(k, v) for k, v in stmt.items()]
+            if len(fns) == 1:
+                return fns[0]
+            return collect(fns, has_return(stmt))
+        elif type(stmt) == list:
+            fns = [self.compile_expr(x) for x in stmt]
+            return collect(fns, has_return(stmt))
+        else:
+            return const(stmt)
+
+    def compile_stmt(self, cmd: str, value: Any) -> Closure:
+        handler = self.handlers.get(cmd)
+        if handler is None:
+            return fail(UnknownCommandError(f'Unrecognized command "{cmd}"'))
+        if self.profiler is None:
+            return handler(cmd, value)
+        self.path.append(cmd)
+        try:
+            location = '.'.join(self.path)
+            return self.profiler.wrap(Operators.symbol(cmd), location, handler(cmd, value))
+        finally:
+            self.path.pop()
+
+    def compile_block(self, code_block: Any) -> Closure:
+        fns = []
+        self.__flatten_block(code_block, fns)
+        return sequence(fns, has_return(code_block))
+
+    def __flatten_block(self, code_block: Any, fns: List[Closure]):
+        if type(code_block) == dict:
+            for k, v in code_block.items():
+                fns.append(self.compile_stmt(k, v))
+        elif type(code_block) == list:
+            for i, s in enumerate(code_block):
+                start = len(fns)
+                if self.profiler is not None:
+                    self.path.append(str(i))
+                    try:
+                        self.__flatten_block(s, fns)
+                    finally:
+                        self.path.pop()
+                else:
+                    self.__flatten_block(s, fns)
+                if len(fns) == start:
+                    # An empty nested block still yields None as its value
+                    fns.append(const(None))
+        else:
+            fns.append(const(code_block))
+
+    def compile_comment(self, cmd: str, value: Any) -> Closure:
+        return const(None)
+
+    def compile_python(self, cmd: str, value: Any) -> Closure:
+        try:
+            code = compile(value, '<python>', 'eval')
+        except Exception as ex:
+            return fail(ex)
+        def run(rt, fr):
+            rt.check_allowed(cmd)
+            return eval(code, vars(runtime), {'self': rt})
+        return run
+
+    def compile_print(self, cmd: str, value: Any) -> Closure:
+        fn = self.compile_expr(value)
+        return lambda rt, fr: rt.output.emit(fn(rt, fr))
+
+    def compile_var(self, cmd: str, value: Any) -> Closure:
+        if type(value) == dict and 'name' in value:
+            value = value['name']
+        elif type(value) != str:
+            return fail(JsonLangRuntimeError('"var" expects an object or a string'))
+        name = value
+        return lambda rt, fr: rt.variables[name]
+
+    def compile_local(self, cmd: str, value: Any) -> Closure:
+        if type(value) == str:
+            return load(self.scope.resolve(value), value)
+        elif type(value) == dict and 'name' in value and 'value' in value:
+            name = value['name']
+            fn = self.compile_expr(value['value'])
+            address = self.scope.resolve(name)
+            if address is not None:
+                return store(address, name, fn)
+            def run(rt, fr):
+                # Assigns only to an existing local, like Runtime.set_local
+                value = fn(rt, fr)
+                if name in rt.locals:
+                    rt.locals[name] = value
+                return rt.locals.get(name)
+            return run
+        return fail(JsonLangRuntimeError('"local" expects an object or a string'))
+
+    def compile_set(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"set" expects an object'))
+        # A value is there when its key is, an empty string is a value too
+        name = value.get('name', '')
+        if name == '' or 'value' not in value:
+            return const(None)
+        val = value['value']
+        fn = self.compile_expr(val)
+        def run(rt, fr):
+            rt.variables[name] = value = fn(rt, fr)
+            return value
+        return run
+
+    def compile_set_local(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"set_local" expects an object'))
+        name = value.get('name', '')
+        if name == '' or 'value' not in value:
+            return fail(InvalidArgumentsError('"set_local" expected name & value'))
+        val = value['value']
+        # The value is compiled before the name is declared, so it still sees an outer local with the same name
+        fn = self.compile_expr(val)
+        slot = self.scope.declare(name)
+        if slot is None:
+            def run(rt, fr):
+                rt.locals[name] = fn(rt, fr)
+        else:
+            def run(rt, fr):
+                fr[slot] = fn(rt, fr)
+        return run
+
+    def compile_if(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"if" expects an object'))
+        def compile_body():
+            cond = self.compile_expr(value.get('condition', ''))
+            then = self.compile_expr(value.get('then', {}))
+            else_ = self.compile_expr(value.get('else', {}))
+            def run(rt, fr):
+                if cond(rt, fr):
+                    return then(rt, fr)
+                return else_(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def compile_for(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"for" expects an object'))
+        for_range = value.get('range')
+        if type(for_range) == dict and 'var' in for_range:
+            return self.__compile_range_for(for_range, value.get('code'))
+        if type(for_range) != list or len(for_range) != 3:
+            return fail(JsonLangRuntimeError('"for" expects a range of [init, condition, step] or an object'))
+        def compile_body():
+            init, cond, step = [self.compile_expr(x) for x in for_range]
+            body = self.compile_block(value.get('code'))
+            if has_return(value.get('code')):
+                def run(rt, fr):
+                    init(rt, fr)
+                    budget = rt.budget
+                    while cond(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        ret = body(rt, fr)
+                        if ret.__class__ is Return:
+                            return ret
+                        step(rt, fr)
+            else:
+                def run(rt, fr):
+                    init(rt, fr)
+                    budget = rt.budget
+                    while cond(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        body(rt, fr)
+                        step(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def __compile_range_for(self, for_range: dict, code: Any) -> Closure:
+        # {"var": name, "from": start, "to": stop, "step": step} counts with a Python range,
+        # {"var": name, "in": expr} iterates over the value of expr.
+        # The loop variable is stored straight into its slot by the Python for loop.
+        if 'in' not in for_range and 'to' not in for_range:
+            return fail(JsonLangRuntimeError('"for" range expects "to" or "in"'))
+        def compile_body():
+            if 'in' in for_range:
+                items = self.compile_expr(for_range['in'])
+            else:
+                start = self.compile_expr(for_range.get('from', 0))
+                stop = self.compile_expr(for_range['to'])
+                step = self.compile_expr(for_range.get('step', 1))
+                items = lambda rt, fr: range(start(rt, fr), stop(rt, fr), step(rt, fr))
+            slot = self.scope.declare(for_range['var'])
+            body = self.compile_block(code)
+            if has_return(code):
+                def run(rt, fr):
+                    budget = rt.budget
+                    for fr[slot] in items(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        ret = body(rt, fr)
+                        if ret.__class__ is Return:
+                            return ret
+            else:
+                def run(rt, fr):
+                    budget = rt.budget
+                    for fr[slot] in items(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        body(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def compile_while(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"while" expects an object'))
+        def compile_body():
+            cond = self.compile_expr(value.get('condition'))
+            body = self.compile_block(value.get('code'))
+            if has_return(value.get('code')):
+                def run(rt, fr):
+                    budget = rt.budget
+                    while cond(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        ret = body(rt, fr)
+                        if ret.__class__ is Return:
+                            return ret
+            else:
+                def run(rt, fr):
+                    budget = rt.budget
+                    while cond(rt, fr):
+                        if budget is not None:
+                            budget.step()
+                        body(rt, fr)
+            return run
+        return self.scoped(compile_body)
+
+    def compile_switch(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"switch" expects an object'))
+        def compile_body():
+            switch_value = self.compile_expr(value['value']) if 'value' in value else const(None)
+            cases = {k: self.compile_block(v) for k, v in value.get('case', {}).items()}
+            default = cases.get(runtime.Constants.wildcard_symbol)
+            returns = has_return(value.get('case', {}))
+            def run(rt, fr):
+                case = cases.get(str(switch_value(rt, fr)), default)
+                if case is not None:
+                    ret = case(rt, fr)
+                    if returns and ret.__class__ is Return:
+                        return ret
+            return run
+        return self.scoped(compile_body)
+
+    def scoped(self, compile_body: Callable[[], Closure]) -> Closure:
+        body, slots = self.__compile_scoped(compile_body)
+        if len(slots) == 0:
+            return body
+        def run(rt, fr):
+            for slot in slots:
+                fr[slot] = None
+            return body(rt, fr)
+        return run
+
+    def compile_def(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"def" expects an object'))
+        name = value.get('name', '')
+        args = value.get('args', [])
+        code = value.get('code', {})
+        if name == '':
+            return const(None)
+        site = Definition(self.scope)
+        if value.get('pure', False):
+            try:
+                cache_size = runtime.PureFunction.check_options(value)
+            except InvalidArgumentsError as ex:
+                return fail(ex)
+            def run(rt, fr):
+                rt.functions[name] = runtime.PureFunction(args, code, site.unit, fr, name, cache_size, site)
+        else:
+            def run(rt, fr):
+                rt.functions[name] = runtime.Function(args, code, site.unit, fr, name, site)
+        return run
+
+    def compile_parallel_for(self, cmd: str, value: Any) -> Closure:
+        # The code is compiled as a function of the loop variable, parallel.run calls it for every item
+        if type(value) != dict:
+            return fail(JsonLangRuntimeError('"parallel_for" expects an object'))
+        for_range = value.get('range')
+        if type(for_range) != dict or 'var' not in for_range or ('in' not in for_range and 'to' not in for_range):
+            return fail(JsonLangRuntimeError('"parallel_for" expects a range with "var" and "in" or "to"'))
+        code = value.get('code')
+        try:
+            options = parallel.Options.parse(cmd, value)
+            parallel.check_body(code, for_range['var'])
+        except (InvalidArgumentsError, JsonLangRuntimeError) as ex:
+            return fail(ex)
+        if 'in' in for_range:
+            items = self.compile_expr(for_range['in'])
+        else:
+            start = self.compile_expr(for_range.get('from', 0))
+            stop = self.compile_expr(for_range['to'])
+            step = self.compile_expr(for_range.get('step', 1))
+            items = lambda rt, fr: range(start(rt, fr), stop(rt, fr), step(rt, fr))
+        args = [for_range['var']]
+        unit = self.compile_function(code, args, self.scope)
+        def run(rt, fr):
+            return parallel.run(rt, runtime.Function(args, code, unit, fr, 'parallel_for'), items(rt, fr), options)
+        return run
+
+    def compile_pmap(self, cmd: str, value: Any) -> Closure:
+        if type(value) != dict or type(value.get('function')) != str or 'in' not in value:
+            return fail(JsonLangRuntimeError('"pmap" expects a "function" name and the items "in"'))
+        try:
+            options = parallel.Options.parse(cmd, value)
+        except InvalidArgumentsError as ex:
+            return fail(ex)
+        name = value['function']
+        items = self.compile_expr(value['in'])
+        def run(rt, fr):
+            if name not in rt.functions:
+                raise JsonLangRuntimeError(f'Unknown function "{name}"')
+            return parallel.run(rt, rt.functions[name], items(rt, fr), options)
+        return run
+
+    def compile_call_args(self, value: Any, compile_expr: Callable[[Any], Closure] = None) -> Optional[Tuple[str, List[Closure]]]:
+        compile_expr = compile_expr or self.compile_expr
+        name, args = '', []
+        if type(value) == str:
+            name = value
+        elif type(value) == dict:
+            name = value.get('name', '')
+            if 'args' in value:
+                if type(value['args']) == list:
+                    args = [compile_expr(x) for x in value['args']]
+                else:
+                    args = [compile_expr(value['args'])]
+        else:
+            return None
+        return name, args
+
+    def compile_call(self, cmd: str, value: Any) -> Closure:
+        call = self.compile_call_args(value)
+        if call is None:
+            return fail(JsonLangRuntimeError('"call" expects an object or a string'))
+        name, args = call
+        # Functions are called here rather than through Runtime.invoke_function,
+        # which would take another Python frame for every level of recursion
+        if len(args) == 0:
+            def run(rt, fr):
+                function = rt.functions.get(name)
+                if function is None or rt.profiler is not None:
+                    return rt.invoke_function(name, [])
+                return function(rt, [])
+        elif len(args) == 1:
+            arg, = args
+            def run(rt, fr):
+                arg_values = [arg(rt, fr)]
+                function = rt.functions.get(name)
+                if function is None or rt.profiler is not None:
+                    return rt.invoke_function(name, arg_values)
+                return function(rt, arg_values)
+        else:
+            def run(rt, fr):
+                arg_values = [arg(rt, fr) for arg in args]
+                function = rt.functions.get(name)
+                if function is None or rt.profiler is not None:
+                    return rt.invoke_function(name, arg_values)
+                return function(rt, arg_values)
+        return run
+
+    def compile_return(self, cmd: str, value: Any) -> Closure:
+        if type(value) == dict and len(value) == 1 and 'call' in value:
+            call = self.compile_call_args(value['call'])
+            if call is not None:
+                name, args = call
+                return lambda rt, fr: Return([arg(rt, fr) for arg in args], name)
+        fn = self.compile_expr(value)
+        return lambda rt, fr: Return(fn(rt, fr))
+
+    def compile_import(self, cmd: str, value: Any) -> Closure:
+        if type(value) == str:
+            value = [value]
+        elif type(value) != list:
+            return fail(JsonLangRuntimeError('"import" expects a list or a string'))
+        files = value
+        def run(rt, fr):
+            for x in files:
+                rt.import_program(x)
+        return run
+
+    def compile_breakpoint(self, cmd: str, value: Any) -> Closure:
+        if value != 'cli':
+            return const(None)
+        def run(rt, fr):
+            # The REPL (and readline) is only imported when it's used
+            from . import cli
+            rt.check_allowed(cmd)
+            rt.output.flush()
+            repl = cli.Repl()
+            repl.set_runtime(rt)
+            repl.run()
+        return run
+
+    def compile_async_only(self, cmd: str, value: Any) -> Closure:
+        return fail(JsonLangRuntimeError(f'"{cmd}" needs the async runtime (Runtime.run_async)'))
+
+    def compile_operator(self, cmd: str, value: Any) -> Closure:
+        symbol = Operators.symbol(cmd)
+        if type(value) != list:
+            return fail(JsonLangRuntimeError(f'"{symbol}" expects a list'))
+        allocates = self.metered and symbol in Operators.allocating
+        if len(value) == 2:
+            left = self.compile_expr(value[0])
+            if symbol in Operators.const_pairs and (value[1] is None or type(value[1]) in [int, float, str, bool]):
+                return (Operators.metered_const_pairs if allocates else Operators.const_pairs)[symbol](left, value[1])
+            return (Operators.metered_pairs if allocates else Operators.pairs)[symbol](left, self.compile_expr(value[1]))
+        fns = [self.compile_expr(x) for x in value]
+        if symbol == '&&':
+            def run(rt, fr):
+                ret = True
+                for fn in fns:
+                    ret = fn(rt, fr)
+                    if not ret:
+                        break
+                return ret
+        elif symbol == '||':
+            def run(rt, fr):
+                ret = False
+                for fn in fns:
+                    ret = fn(rt, fr)
+                    if ret:
+                        break
+                return ret
+        elif len(fns) == 0:
+            return fail(JsonLangRuntimeError(f'"{symbol}" expects at least one operand'))
+        elif symbol in Operators.comparisons:
+            op = Operators.binary[symbol]
+            first, rest = fns[0], fns[1:]
+            def run(rt, fr):
+                return arrays.compare(op, first(rt, fr), (fn(rt, fr) for fn in rest))
+        else:
+            op = Operators.binary[symbol]
+            first, rest = fns[0], fns[1:]
+            def run(rt, fr):
+                ret = first(rt, fr)
+                for fn in rest:
+                    ret = op(ret, fn(rt, fr))
+                    if allocates and rt.budget is not None:
+                        rt.budget.allocate(values.size(ret))
+                return ret
+        return run
+
+    def compile_collection(self, cmd: str, value: Any) -> Closure:
+        op = values.ops[cmd]
+        fns = [self.compile_expr(x) for x in values.operands(value)]
+        try:
+            op.check_args(len(fns))
+        except ArgumentMismathError as ex:
+            return fail(ex)
+        fn = op.fn
+        if op.charge is not None and self.metered:
+            # Operations that grow or build a collection are charged to the budget
+            charge = op.charge
+            def run(rt, fr):
+                args = [f(rt, fr) for f in fns]
+                value = fn(*args)
+                if rt.budget is not None:
+                    rt.budget.allocate(charge(args, value))
+                return value
+            return run
+        if len(fns) == 1:
+            a, = fns
+            return lambda rt, fr: fn(a(rt, fr))
+        if len(fns) == 2:
+            a, b = fns
+            return lambda rt, fr: fn(a(rt, fr), b(rt, fr))
+        if len(fns) == 3:
+            a, b, c = fns
+            return lambda rt, fr: fn(a(rt, fr), b(rt, fr), c(rt, fr))
+        return lambda rt, fr: fn(*[f(rt, fr) for f in fns])
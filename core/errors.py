@@ -18,4 +18,20 @@ class InvalidArgumentsError(Exception):
 
 class UnknownCommandError(Exception):
     def __init__(self, message):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class ImportCycleError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+class ImageError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+class LimitExceededError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+class SandboxError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
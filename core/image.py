@@ -0,0 +1,44 @@
+# image.py
+
+# Runtime images (.jli files): a snapshot of a runtime saved to disk, so a runtime
+# can start from the state a set of programs left it in, without running them again.
+# The snapshot is pickled without compiled code, functions are compiled again
+# (in the scope they were defined in) the first time they're called. Builtins are
+# left out, they come from the runtime the image is loaded into.
+
+import pickle
+import os
+
+from .errors import ImageError
+from .cache import gc_paused
+
+from . import runtime
+
+class Image:
+    extension = '.jli'
+    magic = b'JLI' + bytes([pickle.HIGHEST_PROTOCOL])
+
+    @staticmethod
+    def save(rt: 'runtime.Runtime', path: str):
+        snapshot = rt.snapshot()
+        snapshot.functions = {k: v for k, v in snapshot.functions.items() if type(v) in [runtime.Function, runtime.PureFunction]}
+        try:
+            data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as ex:
+            raise ImageError(f'The runtime can\'t be saved as an image: {ex}')
+        # Written next to the destination first, so a failed write doesn't leave half an image
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(Image.magic)
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(rt: 'runtime.Runtime', path: str):
+        with open(path, 'rb') as f:
+            if f.read(len(Image.magic)) != Image.magic:
+                raise ImageError(f'"{path}" is not an image of this version')
+            with gc_paused():
+                snapshot = pickle.load(f)
+        snapshot.functions = dict(rt.functions, **snapshot.functions)
+        rt.restore(snapshot)
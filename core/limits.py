@@ -0,0 +1,107 @@
+# limits.py
+
+# Limits on what one execution may use, so untrusted programs can run side by side:
+#   steps    loop iterations and function calls
+#   time     wall time, in seconds
+#   depth    nesting of function calls
+#   memory   approximate size of what the program allocates: characters of the strings
+#            and items of the lists, dicts and arrays built by +, *, the collection
+#            operations and the array builtins
+# An execution (Runtime.metered, around every program run, streamed program and
+# server request) gets a Budget, which the interpreter charges where loops iterate,
+# functions are called and collections grow. Steps only bump a counter, the step and
+# time limits are checked (and the clock is read) every Limits.interval steps.
+# Going over a limit raises a LimitExceededError, afterwards Runtime.usage holds the
+# Budget with what the execution consumed.
+#
+# In sandbox mode "py", "breakpoint" and "import" raise a SandboxError instead.
+# Executions with limits run on the interpreter, not on the Python translations of
+# hot functions, and parallel statements run their items one by one.
+
+from typing import Any, Callable, Dict, List, Optional
+import time
+
+from .errors import InvalidArgumentsError, LimitExceededError, SandboxError
+
+class Limits:
+    interval = 1024
+
+    def __init__(self, steps: Optional[int] = None, time: Optional[float] = None, depth: Optional[int] = None,
+                 memory: Optional[int] = None, sandbox: bool = False):
+        for name, x in [('steps', steps), ('time', time), ('depth', depth), ('memory', memory)]:
+            if x is not None and (type(x) not in [int, float] or x <= 0):
+                raise InvalidArgumentsError(f'The {name} limit has to be a positive number')
+        self.steps = steps
+        self.time = time
+        self.depth = depth
+        self.memory = memory
+        self.sandbox = sandbox
+
+    def check_allowed(self, cmd: str):
+        if self.sandbox:
+            raise SandboxError(f'"{cmd}" isn\'t allowed in the sandbox')
+
+class Budget:
+    def __init__(self, limits: Limits):
+        self.limits = limits
+        self.steps = 0
+        self.start = time.monotonic()
+        self.deadline = None if limits.time is None else self.start + limits.time
+        self.depth = 0
+        self.max_depth = 0
+        self.allocated = 0
+        self.next_check = 0
+        self.schedule()
+
+    def schedule(self):
+        # The next check is due after interval steps, or right at the step limit
+        self.next_check = self.steps + Limits.interval
+        if self.limits.steps is not None:
+            self.next_check = min(self.next_check, self.limits.steps + 1)
+
+    def step(self):
+        self.steps += 1
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        if self.limits.steps is not None and self.steps > self.limits.steps:
+            raise LimitExceededError(f'The program ran more than {self.limits.steps} steps')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceededError(f'The program ran longer than {self.limits.time}s')
+        self.schedule()
+
+    def call(self, function: Callable[[Any, List], Any], rt, args: List) -> Any:
+        self.enter()
+        try:
+            return function(rt, args)
+        finally:
+            self.depth -= 1
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+            if self.limits.depth is not None and self.depth > self.limits.depth:
+                raise LimitExceededError(f'The program nested more than {self.limits.depth} calls')
+
+    def exit(self):
+        self.depth -= 1
+
+    def allocate(self, size: int):
+        self.allocated += size
+        if self.limits.memory is not None and self.allocated > self.limits.memory:
+            raise LimitExceededError(f'The program allocated more than {self.limits.memory} items')
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def report(self) -> Dict:
+        return {'steps': self.steps, 'time': round(self.elapsed(), 6), 'depth': self.max_depth, 'memory': self.allocated}
+
+    def __str__(self):
+        def used(value: Any, limit: Any) -> str:
+            return f'{value}/{limit}' if limit is not None else str(value)
+        limits = self.limits
+        return f'steps {used(self.steps, limits.steps)}, time {used(f"{self.elapsed():.3f}s", limits.time and f"{limits.time}s")}, ' \
+               f'depth {used(self.max_depth, limits.depth)}, memory {used(self.allocated, limits.memory)}'
@@ -0,0 +1,138 @@
+# modules.py
+
+# Registry of imported files. Every file is executed once per runtime,
+# it is identified by its resolved path and the hash of its content, so it only
+# runs again if it was changed on disk. The transitive import graph is read and
+# parsed (or loaded from the .jlc cache) on a worker pool before the program
+# that starts it is executed.
+
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+import os
+
+from .errors import *
+from .cache import ProgramCache
+from .code import Code
+
+class Source:
+    def __init__(self, path: str, stat: Tuple[int, int], digest: str, json: Any):
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+        self.json = json
+
+class Module:
+    def __init__(self, path: str, stat: Tuple[int, int], digest: str):
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+
+def resolve_path(file_name: str) -> str:
+    return os.path.realpath(file_name)
+
+def file_stat(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def read_source(path: str) -> Source:
+    stat, digest, json = ProgramCache.load(path)
+    return Source(path, stat, digest, json)
+
+def find_imports(code: Code) -> List[str]:
+    # Both the "import" list of a program and literal "import" statements anywhere in its code
+    imports = list(code.imports)
+    stack = [code.code]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) == dict:
+            for k, v in node.items():
+                if k == 'import' and type(v) in [str, list]:
+                    imports.extend(x for x in (v if type(v) == list else [v]) if type(x) == str)
+                else:
+                    stack.append(v)
+        elif type(node) == list:
+            stack.extend(node)
+    return imports
+
+class ModuleRegistry:
+    def __init__(self, workers: Optional[int] = None, processes: bool = False):
+        self.workers = workers
+        self.processes = processes
+        self.modules = {}
+        self.sources = {}
+        self.scanned = set()
+        self.executing = []
+
+    def load(self, file_name: str) -> Optional[Code]:
+        # Returns the code of the file if it has to be executed, None if it already was
+        path = resolve_path(file_name)
+        if path in self.executing:
+            cycle = self.executing[self.executing.index(path):] + [path]
+            raise ImportCycleError('Import cycle: ' + ' -> '.join(os.path.relpath(x) for x in cycle))
+        stat = file_stat(path)
+        module = self.modules.get(path)
+        if module is not None and module.stat == stat:
+            return None
+        source = self.sources.pop(path, None)
+        if source is None or source.stat != stat:
+            source = read_source(path)
+        if module is not None and module.digest == source.digest:
+            module.stat = source.stat
+            return None
+        self.modules[path] = Module(path, source.stat, source.digest)
+        code = Code.from_json(source.json)
+        code.path = path
+        return code
+
+    @contextmanager
+    def execute(self, code: Code):
+        if code.path is None:
+            yield
+            return
+        self.executing.append(code.path)
+        try:
+            yield
+        except BaseException:
+            self.modules.pop(code.path, None)
+            raise
+        finally:
+            self.executing.pop()
+
+    def prefetch(self, code: Code):
+        if code.path is not None:
+            if code.path in self.scanned:
+                return
+            self.scanned.add(code.path)
+        pending = self.__unseen(code)
+        if len(pending) == 0:
+            return
+        # Imported here, programs without imports don't need it
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+        executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with executor(self.workers) as pool:
+            futures = {pool.submit(read_source, path): path for path in pending}
+            while len(futures) > 0:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    futures.pop(future)
+                    try:
+                        source = future.result()
+                        imported = Code.from_json(source.json)
+                    except Exception:
+                        # Errors are reported when the file is actually imported
+                        continue
+                    self.sources[source.path] = source
+                    imported.path = source.path
+                    for path in self.__unseen(imported):
+                        futures[pool.submit(read_source, path)] = path
+
+    def __unseen(self, code: Code) -> List[str]:
+        if code.path is not None:
+            self.scanned.add(code.path)
+        paths = []
+        for file_name in find_imports(code):
+            path = resolve_path(file_name)
+            if path not in self.scanned and path not in self.modules and path not in paths:
+                self.scanned.add(path)
+                paths.append(path)
+        return paths
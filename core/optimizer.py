@@ -0,0 +1,217 @@
+# optimizer.py
+
+# Rewrites programs before they are compiled:
+#  - operators with constant operands are folded into their value (strings of up to
+#    Optimizer.max_folded characters), constant operands of && and || are short-circuited
+#  - "if", "switch" and "while" with constant conditions lose their dead branches,
+#    a remaining branch replaces the "if" when it doesn't bind any locals
+#  - statements after a "return" in the same block are removed
+# The result is plain JsonLang, so it can be dumped and run by either engine.
+
+from typing import Any, List
+
+from .compiler import Operators
+
+from . import runtime
+from . import values
+
+def is_const(value: Any) -> bool:
+    return value is None or type(value) in [int, float, str, bool]
+
+def folded_size(symbol: str, operands: List[Any]) -> int:
+    # The length of the string folding the operands would make, without making it
+    if symbol == '*' and any(type(x) == str for x in operands):
+        size = 1
+        for x in operands:
+            size *= len(x) if type(x) == str else abs(x) if type(x) in [int, bool] else 1
+        return size
+    return sum(len(x) for x in operands if type(x) == str)
+
+def binds_names(stmt: Any) -> bool:
+    # Whether evaluating stmt declares locals in the current scope
+    if type(stmt) == dict:
+        for k, v in stmt.items():
+            if k == 'set_local':
+                return True
+            if k not in ['if', 'for', 'while', 'switch', 'def', 'function'] and binds_names(v):
+                return True
+    elif type(stmt) == list:
+        return any(binds_names(x) for x in stmt)
+    return False
+
+class Optimizer:
+    # Longer strings are left to be built when the program runs
+    max_folded = 1024
+
+    def __init__(self, functions: bool = True, strings: bool = True):
+        # Without functions, the bodies of defs are left as they are, for runtimes that
+        # optimize a function when it's compiled, on its first call. Without strings,
+        # operators making strings aren't folded, so executions with limits pay for them
+        self.functions = functions
+        self.strings = strings
+        self.handlers = {
+            'print': self.optimize_value,
+            'return': self.optimize_value,
+            'local': self.optimize_local,
+            'set': self.optimize_local,
+            'set_local': self.optimize_local,
+            'if': self.optimize_if,
+            'for': self.optimize_for,
+            'while': self.optimize_while,
+            'switch': self.optimize_switch,
+            'def': self.optimize_def,
+            'function': self.optimize_def,
+            'call': self.optimize_call,
+            'parallel_for': self.optimize_for,
+        }
+        for cmd in list(Operators.binary) + list(Operators.logical) + list(Operators.aliases):
+            self.handlers[cmd] = self.optimize_operator
+        # Collection operations change their operands, they are never folded
+        for cmd in values.ops:
+            self.handlers[cmd] = self.optimize_value
+
+    def optimize_expr(self, stmt: Any) -> Any:
+        if type(stmt) == dict:
+            if len(stmt) == 1:
+                (k, v), = stmt.items()
+                return self.optimize_stmt(k, v)
+            return {k: self.optimize_stmt_value(k, v) for k, v in stmt.items()}
+        elif type(stmt) == list:
+            return [self.optimize_expr(x) for x in stmt]
+        return stmt
+
+    def optimize_block(self, code_block: Any) -> Any:
+        if type(code_block) == dict:
+            return self.optimize_expr(code_block)
+        elif type(code_block) == list:
+            block = []
+            for s in code_block:
+                block.append(self.optimize_block(s))
+                if type(s) == dict and 'return' in s:
+                    break
+            return block
+        return code_block
+
+    def optimize_stmt(self, cmd: str, value: Any) -> Any:
+        # Returns the expression that replaces {cmd: value}
+        handler = self.handlers.get(cmd)
+        if handler is None:
+            return {cmd: value}
+        return handler(cmd, value)
+
+    def optimize_stmt_value(self, cmd: str, value: Any) -> Any:
+        # Statements of a dict with several keys can't be replaced, only their values
+        stmt = self.optimize_stmt(cmd, value)
+        if type(stmt) == dict and len(stmt) == 1 and cmd in stmt:
+            return stmt[cmd]
+        return value
+
+    def optimize_value(self, cmd: str, value: Any) -> Any:
+        return {cmd: self.optimize_expr(value)}
+
+    def optimize_local(self, cmd: str, value: Any) -> Any:
+        if type(value) == dict and 'value' in value:
+            value = dict(value, value=self.optimize_expr(value['value']))
+        return {cmd: value}
+
+    def optimize_if(self, cmd: str, value: Any) -> Any:
+        if type(value) != dict:
+            return {cmd: value}
+        value = {k: self.optimize_expr(v) if k in ['condition', 'then', 'else'] else v for k, v in value.items()}
+        cond = value.get('condition', '')
+        if not is_const(cond):
+            return {cmd: value}
+        branch = 'then' if cond else 'else'
+        if branch not in value:
+            return {cmd: {'condition': cond}}
+        taken = value[branch]
+        if is_const(taken) or (type(taken) == dict and len(taken) == 1 and not binds_names(taken)):
+            return taken
+        return {cmd: {'condition': cond, branch: taken}}
+
+    def optimize_for(self, cmd: str, value: Any) -> Any:
+        if type(value) != dict:
+            return {cmd: value}
+        value = dict(value)
+        if type(value.get('range')) == list:
+            value['range'] = [self.optimize_expr(x) for x in value['range']]
+        elif type(value.get('range')) == dict:
+            value['range'] = {k: v if k == 'var' else self.optimize_expr(v) for k, v in value['range'].items()}
+        if 'code' in value:
+            value['code'] = self.optimize_block(value['code'])
+        return {cmd: value}
+
+    def optimize_while(self, cmd: str, value: Any) -> Any:
+        if type(value) != dict:
+            return {cmd: value}
+        value = dict(value)
+        if 'condition' in value:
+            value['condition'] = self.optimize_expr(value['condition'])
+            if is_const(value['condition']) and not value['condition']:
+                value.pop('code', None)
+        if 'code' in value:
+            value['code'] = self.optimize_block(value['code'])
+        return {cmd: value}
+
+    def optimize_switch(self, cmd: str, value: Any) -> Any:
+        if type(value) != dict:
+            return {cmd: value}
+        value = dict(value)
+        if 'value' in value:
+            value['value'] = self.optimize_expr(value['value'])
+        cases = value.get('case', {})
+        if type(cases) == dict:
+            if 'value' in value and is_const(value['value']):
+                key = str(value['value'])
+                if key not in cases:
+                    key = runtime.Constants.wildcard_symbol
+                cases = {key: cases[key]} if key in cases else {}
+            value['case'] = {k: self.optimize_block(v) for k, v in cases.items()}
+        return {cmd: value}
+
+    def optimize_def(self, cmd: str, value: Any) -> Any:
+        if self.functions and type(value) == dict and 'code' in value:
+            value = dict(value, code=self.optimize_block(value['code']))
+        return {cmd: value}
+
+    def optimize_call(self, cmd: str, value: Any) -> Any:
+        if type(value) == dict and 'args' in value:
+            value = dict(value, args=self.optimize_expr(value['args']))
+        return {cmd: value}
+
+    def optimize_operator(self, cmd: str, value: Any) -> Any:
+        if type(value) != list:
+            return {cmd: value}
+        symbol = Operators.symbol(cmd)
+        operands = [self.optimize_expr(x) for x in value]
+        if symbol in Operators.logical:
+            operands = self.__short_circuit(symbol, operands)
+            if len(operands) == 1:
+                return operands[0]
+        if len(operands) > 0 and all(is_const(x) for x in operands) and self.__foldable(symbol, operands):
+            try:
+                result = Operators.evaluate(symbol, operands)
+            except Exception:
+                # Errors are left to be raised when the program runs
+                return {cmd: operands}
+            if is_const(result):
+                return result
+        return {cmd: operands}
+
+    def __foldable(self, symbol: str, operands: List[Any]) -> bool:
+        if not self.strings and symbol in Operators.allocating and any(type(x) == str for x in operands):
+            return False
+        return folded_size(symbol, operands) <= Optimizer.max_folded
+
+    def __short_circuit(self, symbol: str, operands: List[Any]) -> List[Any]:
+        # Constant operands that can't decide the result are dropped,
+        # and operands after one that always decides it are never evaluated
+        result = []
+        for i, x in enumerate(operands):
+            last = i == len(operands) - 1
+            if is_const(x) and bool(x) == (symbol == '&&') and not last:
+                continue
+            result.append(x)
+            if is_const(x) and bool(x) != (symbol == '&&'):
+                break
+        return result
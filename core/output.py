@@ -0,0 +1,112 @@
+# output.py
+
+# Output sinks: where the print statement and the print builtin write to.
+# Every runtime has one (Runtime.output). Printed lines are buffered and written
+# to their stream together once buffer_size characters piled up, or when the
+# runtime flushes them (at the end of every program, REPL command and streamed
+# statement), instead of one write per print. A buffer size of 0 writes every line
+# right away, which is the default on a terminal.
+#
+# In record mode every print is one JSON line (JSONL) holding the printed value,
+# instead of its text. Runtime.output can be any of
+#   Output(stream)       buffered writes to a file, or to sys.stdout with None
+#   CaptureOutput()      keeps the output in memory, getvalue() returns it
+#   NullOutput()         drops the output, for benchmarks
+# and Output.open() makes one from the --output option: "-" (stdout), "null",
+# a file name, or "jsonl:" followed by one of them for record mode.
+
+from typing import Any, IO, List, Optional
+import json
+import io
+import sys
+
+from .errors import InvalidArgumentsError
+
+class Output:
+    buffer_size = 1 << 16
+
+    def __init__(self, stream: Optional[IO] = None, buffer_size: Optional[int] = None, records: bool = False, owned: bool = False):
+        # Without a stream, lines go to whatever sys.stdout is when they are written
+        self.stream = stream
+        if buffer_size is None:
+            # A terminal shows every line as soon as it's printed
+            buffer_size = 0 if (stream or sys.stdout).isatty() else Output.buffer_size
+        self.buffer_size = buffer_size
+        self.records = records
+        self.owned = owned
+        self.parts = []
+        self.size = 0
+
+    def emit(self, value: Any):
+        # Prints one value
+        if self.records:
+            line = json.dumps(value, default=str)
+        else:
+            line = value if value.__class__ is str else str(value)
+        self.parts.append(line)
+        self.parts.append('\n')
+        self.size += len(line) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def emit_all(self, values: List):
+        # Prints the arguments of the print builtin, a list of them in record mode
+        if self.records:
+            self.emit(values[0] if len(values) == 1 else values)
+        else:
+            self.emit(' '.join(str(x) for x in values))
+
+    def write(self, text: str):
+        # Output that was already formatted, like the output of a job
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # Only the parts that are there now are written, a thread may be adding more
+        count = len(self.parts)
+        if count == 0:
+            return
+        text = ''.join(self.parts[:count])
+        del self.parts[:count]
+        self.size = max(0, self.size - len(text))
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.stream.close()
+
+    @staticmethod
+    def open(spec: str, buffer_size: Optional[int] = None) -> 'Output':
+        if buffer_size is not None and buffer_size < 0:
+            raise InvalidArgumentsError('The buffer size can\'t be negative')
+        records = spec.startswith('jsonl:')
+        if records:
+            spec = spec[len('jsonl:'):]
+        if spec in ['', '-']:
+            return Output(None, buffer_size, records)
+        if spec == 'null':
+            return NullOutput()
+        return Output(open(spec, 'w'), buffer_size, records, True)
+
+class CaptureOutput(Output):
+    def __init__(self, records: bool = False):
+        super().__init__(io.StringIO(), sys.maxsize, records)
+
+    def getvalue(self) -> str:
+        self.flush()
+        return self.stream.getvalue()
+
+class NullOutput(Output):
+    def emit(self, value: Any):
+        pass
+
+    def emit_all(self, values: List):
+        pass
+
+    def write(self, text: str):
+        pass
@@ -0,0 +1,214 @@
+# parallel.py
+
+# Runs independent iterations on a pool of workers:
+#   {"parallel_for": {"range": {"var": "c", "in": expr}, "code": ..., options}}
+#   {"pmap": {"function": name, "in": expr, options}}
+# yield the list of the values of the iterations (the value of the code, or what it
+# returns) or of the calls, in the order of the items. The options are
+#   "workers": N          defaults to the number of cores
+#   "chunk_size": N       items sent to a worker process at once
+#   "backend": "process"  or "thread", threads share the runtime but not the cores
+#   "reduce": op          combines the values with an operator ("+") or a function
+#                         (the name of a function of two arguments) instead
+#
+# Process workers get the user functions, the variables the code reads and the top
+# level locals once, when the pool starts. Iterations can't write to anything they
+# share: "set", "def", "import", and assignments or appends to outer locals in the
+# body are errors, and variables are read-only while it runs, also for the functions
+# it calls. Values leave an iteration by being its result, to be reduced.
+# What worker processes print comes back with the results, in the order of the items.
+# The walker, parallel statements inside an iteration, and executions with limits
+# (which workers couldn't charge) run the items one by one.
+
+from functools import reduce
+from typing import Any, Dict, List, Optional, Set, Tuple
+import os
+
+from .errors import *
+from .output import CaptureOutput
+
+from . import runtime
+from . import arrays
+
+class Options:
+    backends = ['process', 'thread']
+
+    def __init__(self, workers: Optional[int], chunk_size: Optional[int], backend: str, reduce: Optional[str]):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.backend = backend
+        self.reduce = reduce
+
+    @staticmethod
+    def parse(cmd: str, value: Dict) -> 'Options':
+        workers, chunk_size = value.get('workers'), value.get('chunk_size')
+        for name, x in [('workers', workers), ('chunk_size', chunk_size)]:
+            if x is not None and (type(x) != int or x < 1):
+                raise InvalidArgumentsError(f'"{cmd}" expects "{name}" to be a positive integer')
+        backend = value.get('backend', 'process')
+        if backend not in Options.backends:
+            raise InvalidArgumentsError(f'"{cmd}" expects "backend" to be one of: {", ".join(Options.backends)}')
+        if 'reduce' in value and type(value['reduce']) != str:
+            raise InvalidArgumentsError(f'"{cmd}" expects "reduce" to be an operator or a function name')
+        return Options(workers, chunk_size, backend, value.get('reduce'))
+
+class ReadOnlyVariables(dict):
+    def __setitem__(self, key: str, value: Any):
+        raise JsonLangRuntimeError(f'Variable "{key}" can\'t be set in a parallel iteration, return its value and "reduce" them')
+
+    def __delitem__(self, key: str):
+        raise JsonLangRuntimeError(f'Variable "{key}" can\'t be deleted in a parallel iteration')
+
+    def update(self, *args, **kwargs):
+        raise JsonLangRuntimeError('Variables can\'t be set in a parallel iteration')
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+def declared_names(stmt: Any, names: Set[str]):
+    if type(stmt) == dict:
+        for k, v in stmt.items():
+            if k == 'set_local' and type(v) == dict and type(v.get('name')) == str:
+                names.add(v['name'])
+            elif k == 'for' and type(v) == dict and type(v.get('range')) == dict and type(v['range'].get('var')) == str:
+                names.add(v['range']['var'])
+            declared_names(v, names)
+    elif type(stmt) == list:
+        for x in stmt:
+            declared_names(x, names)
+
+def check_target(cmd: str, target: Any, names: Set[str]):
+    # The collection an append or put changes has to belong to the iteration
+    if type(target) == dict and len(target) == 1:
+        (k, v), = target.items()
+        if k == 'var' or (k == 'local' and type(v) == str and v not in names):
+            raise JsonLangRuntimeError(f'"{cmd}" can\'t change a value shared by parallel iterations, build it from their results')
+
+def check_writes(stmt: Any, names: Set[str]):
+    if type(stmt) == dict:
+        for k, v in stmt.items():
+            if k == 'set':
+                raise JsonLangRuntimeError('Variables can\'t be set in a parallel iteration, return the values and "reduce" them')
+            if k in ['def', 'function', 'import']:
+                raise JsonLangRuntimeError(f'"{k}" isn\'t allowed in a parallel iteration')
+            if k == 'local' and type(v) == dict and v.get('name') not in names:
+                raise JsonLangRuntimeError(f'The outer local "{v.get("name")}" can\'t be set in a parallel iteration')
+            if k in ['append', 'put'] and type(v) == list and len(v) > 0:
+                check_target(k, v[0], names)
+            check_writes(v, names)
+    elif type(stmt) == list:
+        for x in stmt:
+            check_writes(x, names)
+
+def check_body(code: Any, var: str):
+    # Rejects writes to anything the iterations share
+    names = {var}
+    declared_names(code, names)
+    check_writes(code, names)
+
+def read_variables(code: Any, names: Set[str]) -> bool:
+    # Collects the variables code reads, returns False if that can't be known
+    if type(code) == dict:
+        for k, v in code.items():
+            if k in ['py', 'python']:
+                return False
+            if k == 'var':
+                name = v.get('name') if type(v) == dict else v
+                if type(name) != str:
+                    return False
+                names.add(name)
+            elif not read_variables(v, names):
+                return False
+    elif type(code) == list:
+        return all(read_variables(x, names) for x in code)
+    return True
+
+def items(value: Any) -> List:
+    if arrays.is_array(value):
+        return value.tolist()
+    if type(value) == range:
+        return list(value)
+    if type(value) != list:
+        raise JsonLangRuntimeError(f'A parallel iteration expects a list or an array, got {type(value).__name__}')
+    return value
+
+worker = None
+
+def init_worker(state: bytes):
+    global worker
+    import pickle
+    engine, optimize, tier_threshold, records, variables, locals, functions, function = pickle.loads(state)
+    rt = runtime.Runtime(engine, optimize)
+    rt.tier_threshold = tier_threshold
+    rt.variables = ReadOnlyVariables(variables)
+    rt.locals = locals
+    rt.functions.update(functions)
+    rt.in_parallel = True
+    rt.output = CaptureOutput(records)
+    worker = (rt, function)
+
+def run_item(item: Any) -> Tuple[Any, str]:
+    # The output of an item goes back with its result, to be written in order
+    rt, function = worker
+    rt.output = CaptureOutput(rt.output.records)
+    return function(rt, [item]), rt.output.getvalue()
+
+def worker_state(rt: 'runtime.Runtime', function: Any) -> bytes:
+    # Only the user functions go to the workers, builtins are there already.
+    # pickle is imported here, like the pools, most programs don't run parallel statements
+    import pickle
+    functions = {k: v for k, v in rt.functions.items() if type(v) in [runtime.Function, runtime.PureFunction]}
+    names = set()
+    if isinstance(function, runtime.Function) and all(read_variables(x.function, names) for x in list(functions.values()) + [function]):
+        variables = {k: v for k, v in rt.variables.items() if k in names}
+    else:
+        variables = dict(rt.variables)
+    state = (rt.engine, rt.optimizer is not None, rt.tier_threshold, rt.output.records, variables, rt.locals, functions, function)
+    try:
+        return pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as ex:
+        raise JsonLangRuntimeError(f'The iteration can\'t be sent to worker processes ({ex}), try "backend": "thread"')
+
+def run_all(rt: 'runtime.Runtime', function: Any, values: List, options: Options) -> List:
+    if rt.engine == 'walker' or rt.in_parallel or rt.budget is not None or options.workers == 1 or len(values) <= 1:
+        return [function(rt, [x]) for x in values]
+    # Imported here, most programs don't run parallel statements
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    workers = min(options.workers, len(values))
+    if options.backend == 'thread':
+        # The threads share the runtime, parallel statements they run are run one by one
+        rt.in_parallel = True
+        try:
+            with ThreadPoolExecutor(workers) as pool:
+                return list(pool.map(lambda x: function(rt, [x]), values))
+        finally:
+            rt.in_parallel = False
+    chunk_size = options.chunk_size or max(1, len(values) // (workers * 4))
+    results = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(worker_state(rt, function),)) as pool:
+        for value, output in pool.map(run_item, values, chunksize=chunk_size):
+            rt.output.write(output)
+            results.append(value)
+    return results
+
+def combine(rt: 'runtime.Runtime', results: List, name: str) -> Any:
+    if len(results) == 0:
+        return None
+    symbol = runtime.compiler.Operators.symbol(name)
+    if symbol in runtime.compiler.Operators.binary or symbol in runtime.compiler.Operators.logical:
+        return runtime.compiler.Operators.evaluate(symbol, results)
+    if name not in rt.functions:
+        raise JsonLangRuntimeError(f'Unknown function "{name}" to reduce with')
+    return reduce(lambda a, b: rt.invoke_function(name, [a, b]), results)
+
+def run(rt: 'runtime.Runtime', function: Any, values: Any, options: Options) -> Any:
+    # Calls function with every item of values, the calls can't write variables
+    values = items(values)
+    variables, rt.variables = rt.variables, ReadOnlyVariables(rt.variables)
+    try:
+        results = run_all(rt, function, values, options)
+    finally:
+        rt.variables = variables
+    if options.reduce is not None:
+        return combine(rt, results, options.reduce)
+    return results
@@ -1,9 +1,11 @@
 # parser.py
 
 import json
+import os
 
 from .errors import ParseError
 from .code import Code
+from .cache import ProgramCache
 
 class Parser:
 
@@ -14,6 +16,17 @@ class Parser:
         except Exception as e:
             raise ParseError(str(e))
 
+    @staticmethod
+    def parse_file(path: str) -> Code:
+        path = os.path.realpath(path)
+        _, _, json = ProgramCache.load(path)
+        try:
+            code = Code.from_json(json)
+        except Exception as e:
+            raise ParseError(str(e))
+        code.path = path
+        return code
+
     @staticmethod
     def parse_json(s: str) -> dict:
         return json.loads(s)
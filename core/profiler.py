@@ -0,0 +1,96 @@
+# profiler.py
+
+# Opt-in profiler for JsonLang programs.
+# While it's enabled, the compiler wraps every statement in a closure that times it,
+# and Runtime.invoke_function times every function call, so nothing is measured
+# (or paid for) while it's disabled. Times are kept per opcode, per function and
+# per source location, together with the call stacks they were spent in, which
+# can be written in the collapsed format used by flamegraph tools.
+
+from typing import Any, Callable, List, IO
+import time
+
+class Stat:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_time = 0.0
+        self.active = 0
+
+class Profiler:
+    kinds = ['function', 'opcode', 'location']
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.stats = {kind: {} for kind in Profiler.kinds}
+        self.stacks = {}
+        # Every entry is [label, stats, start time, time spent in children]
+        self.stack = []
+
+    def wrap(self, opcode: str, location: str, fn: Callable) -> Callable:
+        stats = [self.__stat('opcode', opcode), self.__stat('location', location)]
+        def run(rt, fr):
+            entry = self.enter(opcode, stats)
+            try:
+                return fn(rt, fr)
+            finally:
+                self.exit(entry)
+        return run
+
+    def call(self, name: str, function: Callable, rt, args: List) -> Any:
+        entry = self.enter(name, [self.__stat('function', name)])
+        try:
+            return function(rt, args)
+        finally:
+            self.exit(entry)
+
+    def enter(self, label: str, stats: List[Stat]) -> List:
+        for stat in stats:
+            stat.calls += 1
+            stat.active += 1
+        entry = [label, stats, self.clock(), 0.0]
+        self.stack.append(entry)
+        return entry
+
+    def exit(self, entry: List):
+        elapsed = self.clock() - entry[2]
+        self_time = elapsed - entry[3]
+        key = ';'.join(e[0] for e in self.stack)
+        self.stacks[key] = self.stacks.get(key, 0.0) + self_time
+        self.stack.pop()
+        if len(self.stack) > 0:
+            self.stack[-1][3] += elapsed
+        for stat in entry[1]:
+            stat.active -= 1
+            stat.self_time += self_time
+            # Recursive calls are only counted once in the cumulative time
+            if stat.active == 0:
+                stat.total += elapsed
+
+    def reset(self):
+        # Compiled code holds on to its stats, so they are cleared in place
+        for stats in self.stats.values():
+            for stat in stats.values():
+                stat.calls, stat.total, stat.self_time = 0, 0.0, 0.0
+        self.stacks = {}
+
+    def report(self, out: IO, limit: int = 20):
+        for kind in Profiler.kinds:
+            stats = sorted(self.stats[kind].items(), key=lambda x: x[1].self_time, reverse=True)
+            if len(stats) == 0:
+                continue
+            out.write(f'{kind:<40} {"calls":>10} {"total ms":>12} {"self ms":>12}\n')
+            for key, stat in stats[:limit]:
+                out.write(f'{key[:40]:<40} {stat.calls:>10} {stat.total * 1000:>12.3f} {stat.self_time * 1000:>12.3f}\n')
+            out.write('\n')
+
+    def write_collapsed(self, out: IO):
+        # One line per stack, "frame;frame;frame microseconds"
+        for key, value in sorted(self.stacks.items()):
+            out.write(f'{key} {int(value * 1e6)}\n')
+
+    def __stat(self, kind: str, key: str) -> Stat:
+        stats = self.stats[kind]
+        if key not in stats:
+            stats[key] = Stat()
+        return stats[key]
@@ -1,38 +1,258 @@
 # runtime.py
 
-from typing import List, Dict, Callable, Any
+from typing import List, Dict, Callable, Any, IO
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import reduce
+import copy
 import sys
 
 from .errors import *
-from .parser import Parser
 from .code import Code
+from .modules import ModuleRegistry
+from .stream import ProgramStream
+from .profiler import Profiler
+from .output import Output
+from .limits import Budget, Limits
 
-from . import cli
+from . import compiler
+from . import optimizer
+from . import transpiler
+from . import values
+from . import arrays
+from . import parallel
 
 class Constants:
     wildcard_symbol = '_'
+    engines = ['compiled', 'walker']
+    cache_size = 128
+    tier_threshold = 1000
+    # Python recursion limit, and the C stack a Python frame takes at most,
+    # awaiting a coroutine takes a lot more than calling a function
+    max_recursion_limit = 200000
+    stack_per_frame = 160
+    async_stack_per_frame = 768
+    default_stack = 8 << 20
+
+def recursion_limit(stack_per_frame: int) -> int:
+    # How deep Python can recurse before it runs out of C stack, past it Python would
+    # crash instead of raising RecursionError
+    try:
+        import resource
+    except ImportError:
+        return sys.getrecursionlimit()
+    stack = resource.getrlimit(resource.RLIMIT_STACK)[0]
+    if stack == resource.RLIM_INFINITY or stack <= 0:
+        stack = Constants.default_stack
+    return min(stack // stack_per_frame, Constants.max_recursion_limit)
+
+def raise_recursion_limit():
+    # Every call of a JsonLang function takes several Python frames, so Python's default
+    # limit would stop recursion after about a hundred calls
+    limit = recursion_limit(Constants.stack_per_frame)
+    if limit > sys.getrecursionlimit():
+        sys.setrecursionlimit(limit)
 
 class Function:
-    def __init__(self, args: List[str], function: Callable[[List], Any]):
+    cache = None
+    # The scope the function was defined in, once its compiled unit was dropped from an image
+    scope = None
+
+    def __init__(self, args: List[str], function: Callable[[List], Any], unit: 'compiler.Unit' = None, env: List = None, name: str = '',
+                 site: 'compiler.Definition' = None):
+        # Without a unit, the function is compiled on its first call, site is the def that made it
         self.args = args
         self.function = function
+        self.unit = unit
+        self.env = env
+        self.name = name
+        self.site = site
+        self.calls = 0
+        self.native = None
 
-    def __call__(self, runtime, args: List) -> Any:
-        runtime.enter_scope()
-        if self.args is None:
-            runtime.locals['__args__'] = args
-        else:
+    def check_args(self, args: List):
+        if self.args is not None:
             if args is None:
                 raise ArgumentMismathError(f'Function.__call__(): Expected list, got {type(args)}')
-            if len(self.args) == len(args):
+            if len(self.args) != len(args):
+                raise ArgumentMismathError(f'Expected {len(self.args)} arguments, but got {len(args)}')
+
+    def __call__(self, runtime, args: List) -> Any:
+        self.check_args(args)
+        if runtime.budget is not None:
+            return runtime.budget.call(self.call, runtime, args)
+        if runtime.engine == 'compiled':
+            # Same as call(), without a Python frame more for every JsonLang call
+            ret = self.run(runtime, args)
+            if ret.__class__ is compiler.Return:
+                return runtime.complete(ret)
+            return ret
+        return self.call(runtime, args)
+
+    def call(self, runtime, args: List) -> Any:
+        if runtime.engine == 'compiled':
+            ret = self.run(runtime, args)
+            if ret.__class__ is compiler.Return:
+                return runtime.complete(ret)
+            return ret
+        # A return from inside a nested block unwinds past its exit_scope(),
+        # so the caller's scope is restored explicitly
+        caller_locals, caller_depth = runtime.locals, runtime.depth
+        if runtime.budget is not None:
+            runtime.budget.step()
+        runtime.enter_scope()
+        try:
+            if self.args is None:
+                runtime.locals['__args__'] = args
+            else:
                 for i in range(len(args)):
                     runtime.locals[self.args[i]] = args[i]
-            else:
-                raise ArgumentMismathError(f'Expected {len(self.args)} arguments, but got {len(args)}')
-        res = runtime.run_block(self.function)
-        runtime.exit_scope()
-        return res
+            return runtime.run_block(self.function)
+        finally:
+            runtime.locals, runtime.depth = caller_locals, caller_depth
+
+    def run(self, runtime, args: List) -> Any:
+        # Runs the compiled body, a return comes back as a compiler.Return signal.
+        # Once the function was called tier_threshold times, its Python translation
+        # is used instead, if it has one, unless the call is profiled or metered.
+        if runtime.budget is not None:
+            runtime.budget.step()
+        elif self.native is not None and runtime.profiler is None:
+            return self.native(runtime, args)
+        unit = self.unit
+        if unit is None or unit.profiler is not runtime.profiler or (runtime.budget is not None and not unit.metered):
+            unit = self.compile(runtime)
+        self.calls += 1
+        if self.calls == runtime.tier_threshold:
+            self.native = transpiler.transpile(self, runtime)
+        return unit.body(runtime, unit.frame(self.env, args))
+
+    def compile(self, runtime) -> 'compiler.Unit':
+        site, unit = self.site, self.unit
+        if site is not None and site.unit is not None and site.unit is not unit and site.unit.profiler is runtime.profiler and \
+                (runtime.budget is None or site.unit.metered):
+            # Another function made by the same def compiled it already
+            self.unit = site.unit
+            return self.unit
+        parent = unit.parent if unit else site.scope if site else self.scope
+        self.unit = runtime.compile_function(self.function, self.args, parent, self.name)
+        if site is not None:
+            site.unit = self.unit
+        return self.unit
+
+    def __copy__(self) -> 'Function':
+        # Unlike pickling, a copy keeps the compiled code
+        function = object.__new__(self.__class__)
+        function.__dict__.update(self.__dict__)
+        return function
+
+    def __getstate__(self) -> Dict:
+        # Compiled code can't be pickled, it's compiled again when the function is called
+        state = dict(self.__dict__, unit=None, native=None, calls=0, site=None)
+        if self.unit is not None:
+            state['scope'] = self.unit.parent
+        elif self.site is not None:
+            state['scope'] = self.site.scope
+        return state
+
+class CallCache:
+    missing = object()
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(args: List) -> Any:
+        # Arguments are keyed with their types, so f(1) and f(true) are different calls.
+        # Returns None if they can't be hashed.
+        try:
+            key = tuple((type(x), x) for x in args)
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    # The cache keeps its own copies of lists and dicts, and hands out copies,
+    # so callers changing a result don't change what later calls get
+    def get(self, key: Any) -> Any:
+        value = self.entries.get(key, CallCache.missing)
+        if value is CallCache.missing:
+            self.misses += 1
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return copy_value(value)
+
+    def put(self, key: Any, value: Any):
+        self.entries[key] = copy_value(value)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def __str__(self):
+        return f'{len(self.entries)}/{self.size} entries, {self.hits} hits, {self.misses} misses, {self.evictions} evictions'
+
+class PureFunction(Function):
+    # Results of calls with hashable arguments are kept in a LRU cache
+    def __init__(self, args: List[str], function: Callable[[List], Any], unit: 'compiler.Unit' = None, env: List = None, name: str = '', cache_size: int = Constants.cache_size,
+                 site: 'compiler.Definition' = None):
+        super().__init__(args, function, unit, env, name, site)
+        self.cache = CallCache(cache_size)
+
+    def __call__(self, runtime, args: List) -> Any:
+        key = CallCache.key(args)
+        if key is None:
+            return super().__call__(runtime, args)
+        ret = self.cache.get(key)
+        if ret is CallCache.missing:
+            ret = super().__call__(runtime, args)
+            self.cache.put(key, ret)
+        return ret
+
+    @staticmethod
+    def check_options(value: Dict) -> int:
+        # Validates the "cache_size" of a pure def and returns it
+        cache_size = value.get('cache_size', Constants.cache_size)
+        if type(cache_size) != int or cache_size < 1:
+            raise InvalidArgumentsError('"cache_size" expects a positive integer')
+        return cache_size
+
+def copy_value(value: Any) -> Any:
+    # Immutable values are shared, only containers are copied
+    if type(value) in [list, dict] or isinstance(value, values.Builder) or arrays.is_array(value):
+        return copy.deepcopy(value)
+    return value
+
+def copy_values(variables: Dict) -> Dict:
+    return {k: copy_value(v) for k, v in variables.items()}
+
+def copy_functions(functions: Dict) -> Dict:
+    # Closures keep the frames of the code that defined them, which are copied with them.
+    # Functions sharing a frame share its copy, the compiled code is shared.
+    memo = {id(f): f for f in functions.values()}
+    copied = {}
+    for name, function in functions.items():
+        if isinstance(function, Function) and function.env is not None:
+            function = copy.copy(function)
+            function.env = copy.deepcopy(function.env, memo)
+        copied[name] = function
+    return copied
+
+class Snapshot:
+    def __init__(self, variables: Dict, locals: Dict, functions: Dict, programs: Dict, modules: Dict):
+        self.variables = variables
+        self.locals = locals
+        self.functions = functions
+        self.programs = programs
+        self.modules = modules
 
 class ReturnException(Exception):
     def __init__(self, val):
@@ -40,13 +260,32 @@ class ReturnException(Exception):
         self.value = val
 
 class Runtime:
-    def __init__(self):
+    def __init__(self, engine: str = 'compiled', optimize: bool = True):
+        if engine not in Constants.engines:
+            raise InvalidArgumentsError(f'Unknown engine "{engine}", expected one of: {", ".join(Constants.engines)}')
+        self.engine = engine
+        self.compiler = compiler.Compiler()
+        self.optimizer = optimizer.Optimizer(functions=False) if optimize else None
+        self.profiler = None
         self.programs = {}
+        self.modules = ModuleRegistry()
         self.variables = {}
         self.locals = {}
         self.depth = 0
+        self.async_compiler = None
+        self.tier_threshold = Constants.tier_threshold
+        self.tasks = set()
+        self.in_parallel = False
+        self.output = Output()
+        # Limits of every execution, the budget of the one that's running and of the last one
+        self.limits = None
+        self.budget = None
+        self.usage = None
+        raise_recursion_limit()
         self.functions = {
-            'print': lambda rt, args: print(' '.join(str(x) for x in args))
+            'print': lambda rt, args: rt.output.emit_all(args),
+            **values.ops,
+            **arrays.builtins,
         }
 
     def get_local(self, name: str) -> Any:
@@ -68,7 +307,77 @@ class Runtime:
         self.programs[code.name] = code
 
     def invoke_function(self, name: str, args: List):
-        return self.functions[name](self, args) if name != '' and name in self.functions else None
+        if name == '' or name not in self.functions:
+            return None
+        if self.profiler is not None:
+            return self.profiler.call(name, self.functions[name], self, args)
+        return self.functions[name](self, args)
+
+    def complete(self, ret: 'compiler.Return') -> Any:
+        # Yields the value of a return signal. Tail calls are made in this loop
+        # rather than from the function that returns them, so they don't nest.
+        while ret.__class__ is compiler.Return:
+            if ret.name is None:
+                return ret.value
+            name, args = ret.name, ret.value
+            function = self.functions.get(name)
+            if type(function) != Function or self.profiler is not None:
+                return self.invoke_function(name, args)
+            function.check_args(args)
+            ret = function.run(self, args)
+        return ret
+
+    def snapshot(self) -> Snapshot:
+        # Programs don't change once they were defined, so they are shared
+        return Snapshot(copy_values(self.variables), copy_values(self.locals), copy_functions(self.functions),
+                        dict(self.programs), dict(self.modules.modules))
+
+    def restore(self, snapshot: Snapshot):
+        # A snapshot can be restored any number of times
+        self.variables = copy_values(snapshot.variables)
+        self.locals = copy_values(snapshot.locals)
+        self.functions = copy_functions(snapshot.functions)
+        self.programs = dict(snapshot.programs)
+        self.modules.modules = dict(snapshot.modules)
+        self.depth = 0
+
+    def clear_caches(self):
+        for function in self.functions.values():
+            if isinstance(function, Function) and function.cache is not None:
+                function.cache.clear()
+
+    def enable_profiler(self, profiler: Profiler = None) -> Profiler:
+        # Code compiled from now on is instrumented, functions and programs are recompiled when they run
+        self.profiler = self.compiler.profiler = profiler or self.profiler or Profiler()
+        return self.profiler
+
+    def disable_profiler(self):
+        self.profiler = self.compiler.profiler = None
+
+    def set_limits(self, limits: Limits = None):
+        # Code compiled from now on is metered, functions and programs compiled before are compiled again when they run
+        self.limits = limits
+        if self.optimizer is not None:
+            self.optimizer.strings = limits is None
+        for compiler in [self.compiler, self.async_compiler]:
+            if compiler is not None:
+                compiler.metered = limits is not None
+
+    def check_allowed(self, cmd: str):
+        if self.limits is not None:
+            self.limits.check_allowed(cmd)
+
+    @contextmanager
+    def metered(self):
+        # An execution gets a new budget, the programs it imports and runs share it
+        if self.limits is None or self.budget is not None:
+            yield
+            return
+        self.budget = self.usage = Budget(self.limits)
+        try:
+            yield
+        finally:
+            self.budget = None
 
     def enter_scope(self):
         self.depth += 1
@@ -96,9 +405,10 @@ class Runtime:
         if cmd in ['comment', 'ignore']:
             pass
         elif cmd in ['python', 'py']:
+            self.check_allowed(cmd)
             return eval(value)
         elif cmd == 'print':
-            print(self.parse_expr(value))
+            self.output.emit(self.parse_expr(value))
         elif cmd == 'var':
             if type(value) == str:
                 return self.variables[value]
@@ -116,25 +426,17 @@ class Runtime:
             raise JsonLangRuntimeError('"local" expects an object or a string')
         elif cmd == 'set':
             if type(value) == dict:
-                name, val = '', ''
-                if 'name' in value:
-                    name = value['name']
-                if 'value' in value:
-                    val = value['value']
-                if name != '' and val != '':
-                    self.variables[name] = self.parse_expr(val)
+                name = value.get('name', '')
+                if name != '' and 'value' in value:
+                    self.variables[name] = self.parse_expr(value['value'])
                     return self.variables[name]
             else:
                 raise JsonLangRuntimeError('"set" expects an object')
         elif cmd == 'set_local':
             if type(value) == dict:
-                name, val = '', ''
-                if 'name' in value:
-                    name = value['name']
-                if 'value' in value:
-                    val = value['value']
-                if name != '' and val != '':
-                    self.locals[name] = self.parse_expr(val)
+                name = value.get('name', '')
+                if name != '' and 'value' in value:
+                    self.locals[name] = self.parse_expr(value['value'])
                 else:
                     raise InvalidArgumentsError('"set_local" expected name & value')
             else:
@@ -166,12 +468,29 @@ class Runtime:
                     for_code = value['code']
                 if type(for_range) == list:
                     self.parse_expr(for_range[0])
-                # elif type(for_range) == dict: # TODO: range-based for loops
-                run = self.parse_expr(for_range[1])
-                while run:
-                    self.__run_block_impl(for_code)
-                    self.parse_expr(for_range[2])
                     run = self.parse_expr(for_range[1])
+                    while run:
+                        if self.budget is not None:
+                            self.budget.step()
+                        self.__run_block_impl(for_code)
+                        self.parse_expr(for_range[2])
+                        run = self.parse_expr(for_range[1])
+                elif type(for_range) == dict and 'var' in for_range:
+                    if 'in' in for_range:
+                        items = self.parse_expr(for_range['in'])
+                    elif 'to' in for_range:
+                        items = range(self.parse_expr(for_range.get('from', 0)),
+                                      self.parse_expr(for_range['to']),
+                                      self.parse_expr(for_range.get('step', 1)))
+                    else:
+                        raise JsonLangRuntimeError('"for" range expects "to" or "in"')
+                    for x in items:
+                        if self.budget is not None:
+                            self.budget.step()
+                        self.locals[for_range['var']] = x
+                        self.__run_block_impl(for_code)
+                else:
+                    raise JsonLangRuntimeError('"for" expects a range list or object')
                 self.exit_scope()
             else:
                 raise JsonLangRuntimeError('"for" expects an object')
@@ -184,6 +503,8 @@ class Runtime:
                 if 'code' in value:
                     code = value['code']
                 while self.parse_expr(condition):
+                    if self.budget is not None:
+                        self.budget.step()
                     self.__run_block_impl(code)
                 self.exit_scope()
             else:
@@ -213,9 +534,37 @@ class Runtime:
                 if 'code' in value:
                     code = value['code']
                 if name != '':
-                    self.functions[name] = Function(args, code)
+                    if value.get('pure', False):
+                        self.functions[name] = PureFunction(args, code, name=name, cache_size=PureFunction.check_options(value))
+                    else:
+                        self.functions[name] = Function(args, code, name=name)
             else:
                 raise JsonLangRuntimeError('"def" expects an object')
+        elif cmd in ['spawn', 'await', 'gather']:
+            raise JsonLangRuntimeError(f'"{cmd}" needs the async runtime (Runtime.run_async)')
+        elif cmd in ['parallel_for', 'pmap']:
+            # The reference semantics: the items are run one by one, see parallel.run_all
+            if type(value) != dict:
+                raise JsonLangRuntimeError(f'"{cmd}" expects an object')
+            options = parallel.Options.parse(cmd, value)
+            if cmd == 'pmap':
+                if type(value.get('function')) != str or 'in' not in value:
+                    raise JsonLangRuntimeError('"pmap" expects a "function" name and the items "in"')
+                if value['function'] not in self.functions:
+                    raise JsonLangRuntimeError(f'Unknown function "{value["function"]}"')
+                return parallel.run(self, self.functions[value['function']], self.parse_expr(value['in']), options)
+            for_range = value.get('range')
+            if type(for_range) != dict or 'var' not in for_range or ('in' not in for_range and 'to' not in for_range):
+                raise JsonLangRuntimeError('"parallel_for" expects a range with "var" and "in" or "to"')
+            parallel.check_body(value.get('code'), for_range['var'])
+            if 'in' in for_range:
+                items = self.parse_expr(for_range['in'])
+            else:
+                items = range(self.parse_expr(for_range.get('from', 0)),
+                              self.parse_expr(for_range['to']),
+                              self.parse_expr(for_range.get('step', 1)))
+            function = Function([for_range['var']], value.get('code'), name='parallel_for')
+            return parallel.run(self, function, items, options)
         elif cmd == 'call':
             name, args = '', []
             if type(value) == str:
@@ -232,7 +581,7 @@ class Runtime:
                 raise JsonLangRuntimeError('"call" expects an object or a string')
             return self.invoke_function(name, args)
         elif cmd == 'return':
-            raise ReturnException(value)
+            raise ReturnException(self.parse_expr(value))
         elif cmd == 'import':
             if type(value) == list:
                 for x in value:
@@ -243,12 +592,18 @@ class Runtime:
                 raise JsonLangRuntimeError('"import" expects a list or a string') 
         elif cmd == 'breakpoint': # TODO: breakpoints
             if value == 'cli':
+                # The REPL (and readline) is only imported when it's used
+                from . import cli
+                self.check_allowed(cmd)
+                self.output.flush()
                 repl = cli.Repl()
                 repl.set_runtime(self)
                 repl.run()
+        elif cmd in values.ops:
+            return values.ops[cmd](self, [self.parse_expr(x) for x in values.operands(value)])
         elif cmd in ['+', 'add']:
             if type(value) == list:
-                return reduce(lambda x, y: x + y, [self.parse_expr(x) for x in value])
+                return reduce(lambda x, y: self.__allocated(x + y), [self.parse_expr(x) for x in value])
             raise JsonLangRuntimeError('"+" expects a list') 
         elif cmd in ['-', 'sub']:
             if type(value) == list:
@@ -256,7 +611,7 @@ class Runtime:
             raise JsonLangRuntimeError('"-" expects a list')
         elif cmd in ['*', 'mul']:
             if type(value) == list:
-                return reduce(lambda x, y: x * y, [self.parse_expr(x) for x in value])
+                return reduce(lambda x, y: self.__allocated(x * y), [self.parse_expr(x) for x in value])
             raise JsonLangRuntimeError('"*" expects a list')
         elif cmd in ['/', 'div']:
             if type(value) == list:
@@ -264,34 +619,79 @@ class Runtime:
             raise JsonLangRuntimeError('"/" expects a list')
         elif cmd in ['==', 'eq']:
             if type(value) == list:
-                return reduce(lambda x, y: x == y, [self.parse_expr(x) for x in value])
+                return self.__compare('==', lambda x, y: x == y, value)
             raise JsonLangRuntimeError('"==" expects a list')
         elif cmd in ['!=', 'ne']:
             if type(value) == list:
-                return reduce(lambda x, y: x != y, [self.parse_expr(x) for x in value])
+                return self.__compare('!=', lambda x, y: x != y, value)
             raise JsonLangRuntimeError('"!=" expects a list')
         elif cmd in ['<', 'lt']:
             if type(value) == list:
-                return reduce(lambda x, y: x < y, [self.parse_expr(x) for x in value])
+                return self.__compare('<', lambda x, y: x < y, value)
             raise JsonLangRuntimeError('"<" expects a list')
         elif cmd in ['>', 'gt']:
             if type(value) == list:
-                return reduce(lambda x, y: x > y, [self.parse_expr(x) for x in value])
+                return self.__compare('>', lambda x, y: x > y, value)
             raise JsonLangRuntimeError('">" expects a list')
         elif cmd in ['&&', 'and']:
             if type(value) == list:
-                return reduce(lambda x, y: x and y, [self.parse_expr(x) for x in value])
+                ret = True
+                for x in value:
+                    ret = self.parse_expr(x)
+                    if not ret:
+                        break
+                return ret
             raise JsonLangRuntimeError('"&&" expects a list')
         elif cmd in ['||', 'or']:
             if type(value) == list:
-                return reduce(lambda x, y: x or y, [self.parse_expr(x) for x in value])
+                ret = False
+                for x in value:
+                    ret = self.parse_expr(x)
+                    if ret:
+                        break
+                return ret
             raise JsonLangRuntimeError('"||" expects a list')
         else:
             raise UnknownCommandError(f'Unrecognized command "{cmd}"')
 
+    def compile_program(self, code_block: Any, name: str = 'program') -> 'compiler.Unit':
+        if self.optimizer is not None:
+            code_block = self.optimizer.optimize_block(code_block)
+        return self.compiler.compile_program(code_block, name)
+
+    def compile_expression(self, stmt: Any) -> 'compiler.Unit':
+        if self.optimizer is not None:
+            stmt = self.optimizer.optimize_expr(stmt)
+        return self.compiler.compile_expression(stmt)
+
+    def compile_function(self, code_block: Any, args: List[str], parent: 'compiler.Scope' = None, name: str = '') -> 'compiler.Unit':
+        if self.optimizer is not None:
+            code_block = self.optimizer.optimize_block(code_block)
+        return self.compiler.compile_function(code_block, args, parent, name)
+
+    def __allocated(self, value: Any) -> Any:
+        if self.budget is not None:
+            self.budget.allocate(values.size(value))
+        return value
+
+    def __compare(self, symbol: str, op: Callable[[Any, Any], bool], operands: List) -> bool:
+        # Comparisons are chained, a < b < c is a < b && b < c
+        if len(operands) == 0:
+            raise JsonLangRuntimeError(f'"{symbol}" expects at least one operand')
+        return arrays.compare(op, self.parse_expr(operands[0]), (self.parse_expr(x) for x in operands[1:]))
+
+    def eval_expr(self, stmt: Any) -> Any:
+        if self.engine == 'compiled':
+            return self.compile_expression(stmt).run(self)
+        return self.parse_expr(stmt)
+
     def run_stmt(self, code: Dict):
-        for k, v in code.items():
-            self.parse_stmt(k, v)
+        with self.metered():
+            if self.engine == 'compiled':
+                self.compile_program(code, 'repl').run(self)
+                return
+            for k, v in code.items():
+                self.parse_stmt(k, v)
 
     def __run_block_impl(self, code_block) -> Any:
         ret = None
@@ -313,21 +713,101 @@ class Runtime:
             return ex.value
 
     def run_code(self, code: Code):
-        self.variables.update(code.variables)
+        self.prefetch(code)
+        try:
+            with self.metered(), self.modules.execute(code):
+                # Every run starts with its own lists and dicts, a parsed program can be run again (and in other runtimes)
+                self.variables.update(copy_values(code.variables))
+                for x in code.imports:
+                    self.import_program(x)
+                if self.engine == 'compiled':
+                    if code.compiled is None or code.compiled.profiler is not self.profiler or \
+                            (self.budget is not None and not code.compiled.metered):
+                        code.compiled = self.compile_program(code.code, code.name)
+                    code.compiled.run(self)
+                else:
+                    self.run_block(code.code)
+        finally:
+            self.output.flush()
+
+    async def run_async(self, code: Code):
+        # Runs the program with the async compiler, where builtins and functions may be coroutines.
+        # It's imported here, as its AsyncFunction derives from Function.
+        from . import async_compiler
+        if self.engine != 'compiled':
+            raise InvalidArgumentsError('The async runtime needs the compiled engine')
+        if self.async_compiler is None:
+            self.async_compiler = async_compiler.AsyncCompiler()
+            self.async_compiler.metered = self.limits is not None
+            self.functions.update(async_compiler.builtins)
+        self.add_program(code)
+        self.prefetch(code)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(min(limit, recursion_limit(Constants.async_stack_per_frame)))
+        try:
+            with self.metered(), self.modules.execute(code):
+                self.variables.update(copy_values(code.variables))
+                for x in code.imports:
+                    self.import_program(x)
+                # The async compiler compiles functions with the code that defines them
+                code_block = code.code if self.optimizer is None else optimizer.Optimizer(strings=self.limits is None).optimize_block(code.code)
+                unit = self.async_compiler.compile_program(code_block, code.name)
+                ret = await unit.body(self, unit.frame(None, []))
+                if ret.__class__ is compiler.Return:
+                    await async_compiler.complete(self, ret)
+                await async_compiler.drain(self)
+        finally:
+            sys.setrecursionlimit(limit)
+            self.output.flush()
+
+    def run_stream(self, fileobj: IO):
+        # Executes every top level statement as soon as it has been read, then drops it
+        with self.metered():
+            self.__run_stream_impl(fileobj)
+
+    def __run_stream_impl(self, fileobj: IO):
+        stream = ProgramStream(fileobj)
+        code = stream.read_header()
+        self.add_program(code)
+        self.prefetch(code)
+        self.variables.update(copy_values(code.variables))
         for x in code.imports:
             self.import_program(x)
-        self.run_block(code.code)
+        try:
+            for stmt in stream.statements():
+                if self.engine == 'compiled':
+                    unit = self.compile_program(stmt, code.name)
+                    ret = unit.body(self, unit.frame(None, []))
+                    if ret.__class__ is compiler.Return:
+                        self.complete(ret)
+                        break
+                else:
+                    self.__run_block_impl(stmt)
+                # The output of a statement shows up before the next one is read
+                self.output.flush()
+        except ReturnException:
+            pass
+        finally:
+            self.output.flush()
+
+    def prefetch(self, code: Code):
+        # Imported files are read (and cached) ahead, but not in the sandbox, which doesn't let the program import them
+        if self.limits is None or not self.limits.sandbox:
+            self.modules.prefetch(code)
 
     def run_program(self, name: str):
         self.run_code(self.programs[name])
 
     def import_program(self, file_name: str):
-        code = Code.from_json(Parser.parse_json(open(file_name).read()))
+        self.check_allowed('import')
+        code = self.modules.load(file_name)
+        if code is None:
+            return
         self.add_program(code)
         self.run_program(code.name)
 
     @staticmethod
-    def run(code: Code):
-        rt = Runtime()
+    def run(code: Code, engine: str = 'compiled', optimize: bool = True):
+        rt = Runtime(engine, optimize)
         rt.add_program(code)
         rt.run_program(code.name)
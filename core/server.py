@@ -0,0 +1,147 @@
+# server.py
+
+# Execution server: keeps a pool of runtimes that already ran a set of library
+# programs, and runs requests on them, so a request doesn't pay for starting the
+# interpreter and setting up the libraries again.
+#
+# The protocol is one JSON object per line, over a unix socket or a TCP port:
+#   {"id": 1, "program": {"code": [...]}, "variables": {...}}
+#   {"id": 2, "call": "name", "args": [...]}
+# is answered with
+#   {"id": 1, "ok": true, "output": "...", "result": ..., "elapsed_ms": 0.42}
+#   {"id": 2, "ok": false, "error": "JsonLangRuntimeError: ...", "output": "...", "elapsed_ms": 0.1}
+# After every request the runtime is reset to the state it had after the libraries ran.
+# With limits, every request is an execution with its own budget, and the response
+# tells what it consumed: "usage": {"steps": ..., "time": ..., "depth": ..., "memory": ...}.
+
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import socketserver
+import queue
+import json
+import time
+import os
+
+from .errors import *
+from .parser import Parser
+from .image import Image
+from .output import CaptureOutput
+from .limits import Limits
+from .code import Code
+
+from . import runtime
+
+class RuntimePool:
+    def __init__(self, size: int, library: List[str], engine: str = 'compiled', optimize: bool = True, image: Optional[str] = None,
+                 limits: Optional[Limits] = None):
+        self.runtimes = queue.Queue()
+        programs = [Parser.parse_file(path) for path in library]
+        for _ in range(size):
+            rt = runtime.Runtime(engine, optimize)
+            if image is not None:
+                Image.load(rt, image)
+            for code in programs:
+                rt.add_program(code)
+                rt.run_program(code.name)
+            # The libraries are trusted, only requests run with the limits
+            rt.set_limits(limits)
+            # The runtime starts out on copies of the snapshot too, like after every request,
+            # so nothing the libraries made is shared with the snapshot or the other runtimes
+            snapshot = rt.snapshot()
+            rt.restore(snapshot)
+            self.runtimes.put((rt, snapshot))
+
+    @contextmanager
+    def acquire(self):
+        rt, snapshot = self.runtimes.get()
+        try:
+            yield rt
+        finally:
+            rt.restore(snapshot)
+            self.runtimes.put((rt, snapshot))
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Server:
+    def __init__(self, pool: RuntimePool):
+        self.pool = pool
+
+    def handle(self, request: Any) -> Dict:
+        response = {'id': request.get('id')} if type(request) == dict else {'id': None}
+        out = CaptureOutput()
+        start = time.perf_counter()
+        try:
+            if type(request) != dict:
+                raise InvalidArgumentsError('A request has to be an object')
+            with self.pool.acquire() as rt:
+                rt.output = out
+                try:
+                    with rt.metered():
+                        response['result'] = self.run(rt, request)
+                finally:
+                    if rt.usage is not None:
+                        response['usage'] = rt.usage.report()
+            response['ok'] = True
+        except Exception as ex:
+            response['ok'] = False
+            response['error'] = f'{ex.__class__.__name__}: {ex}'
+        response['output'] = out.getvalue()
+        response['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        return response
+
+    def run(self, rt: 'runtime.Runtime', request: Dict) -> Any:
+        variables = request.get('variables', {})
+        if type(variables) != dict:
+            raise InvalidArgumentsError('"variables" expects an object')
+        rt.variables.update(variables)
+        if 'program' in request:
+            if type(request['program']) != dict:
+                raise InvalidArgumentsError('"program" expects an object')
+            code = Code.from_json(request['program'])
+            rt.add_program(code)
+            rt.run_program(code.name)
+            return None
+        if 'call' in request:
+            name, args = request['call'], request.get('args', [])
+            if name not in rt.functions:
+                raise JsonLangRuntimeError(f'Unknown function "{name}"')
+            if type(args) != list:
+                raise InvalidArgumentsError('"args" expects a list')
+            return rt.invoke_function(name, args)
+        raise InvalidArgumentsError('A request needs "program" or "call"')
+
+    def serve(self, socket_path: Optional[str] = None, host: str = '127.0.0.1', port: Optional[int] = None):
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if line.strip() == b'':
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except json.JSONDecodeError as ex:
+                        response = {'id': None, 'ok': False, 'error': f'ParseError: {ex}'}
+                    else:
+                        response = server.handle(request)
+                    self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+                    self.wfile.flush()
+
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            listener = UnixServer(socket_path, Handler)
+        else:
+            listener = TCPServer((host, port), Handler)
+        try:
+            listener.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.server_close()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.unlink(socket_path)
@@ -0,0 +1,35 @@
+# startup.py
+
+# --startup-trace: where the time from starting main.py to the end of the program
+# goes. Every phase (imports, arguments, parsing, compiling, running) is marked
+# when it ends, the report lists how long each one took and how many modules were
+# imported during it, and how many of the defined functions were ever compiled
+# (a def only compiles its function on the first call).
+
+from typing import IO, List
+import time
+import sys
+
+from . import runtime
+
+class StartupTrace:
+    def __init__(self, start: float, modules: int):
+        self.start = self.last = start
+        self.modules = modules
+        self.phases = []
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, len(sys.modules) - self.modules))
+        self.last, self.modules = now, len(sys.modules)
+
+    def report(self, out: IO, runtimes: List['runtime.Runtime']):
+        out.write('startup trace:\n')
+        for name, elapsed, modules in self.phases:
+            out.write(f'  {name:<12} {elapsed * 1000:9.3f}ms  {modules:4} modules imported\n')
+        out.write(f'  {"total":<12} {(self.last - self.start) * 1000:9.3f}ms\n')
+        for rt in runtimes:
+            if rt.engine == 'compiled':
+                functions = [x for x in rt.functions.values() if isinstance(x, runtime.Function)]
+                compiled = sum(1 for x in functions if x.unit is not None)
+                out.write(f'  functions: {len(functions)} defined, {compiled} compiled\n')
@@ -0,0 +1,127 @@
+# stream.py
+
+# Incremental reader for programs that are too big to be parsed in one go.
+# The top level object is read key by key, and the elements of "code" are
+# decoded and handed out one at a time, so only the statement that is being
+# executed has to be in memory. "program", "variables" and "import" have to
+# come before "code", as they are needed before the first statement runs.
+
+from typing import Any, IO, Iterator, Optional
+import codecs
+import json
+
+from .errors import ParseError
+from .code import Code
+
+class ProgramStream:
+    chunk_size = 1 << 16
+    header_keys = {'program', 'variables', 'import'}
+
+    def __init__(self, fileobj: IO):
+        self.fileobj = fileobj
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.header = None
+        self.in_code = False
+
+    def read_header(self) -> Code:
+        # Reads the top level object up to the start of the "code" array
+        header = {}
+        self.__expect('{')
+        while True:
+            if self.__peek() == '}':
+                self.pos += 1
+                self.header = Code.from_json(header)
+                return self.header
+            if len(header) > 0:
+                self.__expect(',')
+            key = self.__read_value()
+            if type(key) != str:
+                raise ParseError(f'Expected a key at offset {self.pos}')
+            self.__expect(':')
+            if key == 'code':
+                self.__expect('[')
+                self.in_code = True
+                self.header = Code.from_json(header)
+                return self.header
+            header[key] = self.__read_value()
+
+    def statements(self) -> Iterator[Any]:
+        if self.header is None:
+            self.read_header()
+        if not self.in_code:
+            return
+        self.in_code = False
+        first = True
+        while True:
+            if self.__peek() == ']':
+                self.pos += 1
+                break
+            if not first:
+                self.__expect(',')
+            first = False
+            yield self.__read_value()
+            self.__compact()
+        self.__read_trailer()
+
+    def __read_trailer(self):
+        # Only keys that are not needed by the header may follow "code"
+        while self.__peek() == ',':
+            self.pos += 1
+            key = self.__read_value()
+            if key in ProgramStream.header_keys or key == 'code':
+                raise ParseError(f'"{key}" has to come before "code" when streaming a program')
+            self.__expect(':')
+            self.__read_value()
+        self.__expect('}')
+
+    def __fill(self) -> bool:
+        if self.eof:
+            return False
+        # Reads at least as much as is buffered, so decoding a large statement stays linear
+        data = self.fileobj.read(max(ProgramStream.chunk_size, len(self.buf) - self.pos))
+        if type(data) == bytes:
+            data = self.decoder.decode(data, final=len(data) == 0)
+        if len(data) == 0:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def __compact(self):
+        if self.pos > ProgramStream.chunk_size:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+
+    def __peek(self) -> Optional[str]:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self.__compact()
+            if not self.__fill():
+                return None
+
+    def __expect(self, ch: str):
+        found = self.__peek()
+        if found != ch:
+            raise ParseError(f'Expected "{ch}" at offset {self.pos}, got {found!r}')
+        self.pos += 1
+
+    def __read_value(self) -> Any:
+        self.__peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ParseError(str(e))
+            self.__fill()
@@ -0,0 +1,311 @@
+# transpiler.py
+
+# Translates the body of a hot function into Python source, which is compiled into
+# a real Python function taking (rt, args), so it runs as bytecode instead of
+# through closures. Function.run switches to it once the function was called
+# Runtime.tier_threshold times.
+#
+# Locals are resolved like the compiler does: every name gets a Python local,
+# names declared in a block are reset when the block is entered, names that don't
+# resolve live in Runtime.locals. A return of a call to the function itself
+# becomes a loop, other tail calls are returned as Return signals.
+# Anything that isn't supported (nested defs, locals of enclosing functions, py,
+# import, ...) raises Unsupported, and the function stays on the interpreter.
+
+from typing import Any, List, Optional
+import builtins
+import math
+
+from .errors import ArgumentMismathError
+from .compiler import Operators, Return, Scope
+
+from . import runtime
+from . import values
+from . import arrays
+
+class Unsupported(Exception):
+    pass
+
+def indent(lines: List[str]) -> List[str]:
+    return ['    ' + line for line in lines]
+
+class Transpiler:
+    def __init__(self, name: str, args: Optional[List[str]], parent: Optional[Scope]):
+        self.name = name
+        self.args = args
+        self.parent = parent
+        self.scopes = [{}]
+        self.names = 0
+        self.temps = 0
+        self.loops = False
+        self.depth = 0
+
+    def transpile(self, code: Any) -> str:
+        if self.args is None:
+            params = [self.declare('__args__')]
+            unpack = [f'{params[0]} = args']
+        else:
+            params = [self.declare(x) for x in self.args]
+            unpack = [f'{", ".join(params)}, = args'] if len(params) > 0 else []
+        body = self.block(code, True)
+        # Locals of the function start as None every time it's entered
+        reset = [f'{x} = None' for x in self.scopes[0].values() if x not in params]
+        if self.loops:
+            body = ['while True:'] + indent(reset + body)
+        else:
+            body = reset + body
+        return '\n'.join(['def native(rt, args):'] + indent(unpack + body)) + '\n'
+
+    def declare(self, name: str) -> str:
+        scope = self.scopes[-1]
+        if name not in scope:
+            scope[name] = f'v{self.names}'
+            self.names += 1
+        return scope[name]
+
+    def resolve(self, name: str) -> Optional[str]:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        if self.parent is not None and self.parent.resolve(name) is not None:
+            raise Unsupported(f'"{name}" is a local of an enclosing function')
+        return None
+
+    def temp(self) -> str:
+        self.temps += 1
+        return f't{self.temps}'
+
+    def scoped(self, translate) -> List[str]:
+        # Names declared in a block are reset when it's entered
+        self.scopes.append({})
+        try:
+            lines = translate()
+            names = list(self.scopes[-1].values())
+        finally:
+            self.scopes.pop()
+        return [f'{x} = None' for x in names] + lines
+
+    def block(self, code: Any, result: bool) -> List[str]:
+        # With result, the value of the last statement is returned
+        items = []
+        self.flatten(code, items)
+        lines = []
+        for i, (cmd, value) in enumerate(items):
+            last = result and i == len(items) - 1
+            if cmd is None:
+                lines.extend([f'return {self.const(value)}'] if last else [])
+            else:
+                lines.extend(self.stmt(cmd, value, last))
+        if result and len(items) == 0:
+            lines.append('return None')
+        return lines
+
+    def flatten(self, code: Any, items: List):
+        if type(code) == dict:
+            items.extend(code.items())
+        elif type(code) == list:
+            for s in code:
+                start = len(items)
+                self.flatten(s, items)
+                if len(items) == start:
+                    items.append((None, None))
+        else:
+            items.append((None, code))
+
+    def branch(self, code: Any, result: bool) -> List[str]:
+        # then/else are expressions, several statements in them yield a list of their values
+        if type(code) == dict and len(code) == 1:
+            return self.block(code, result) or ['pass']
+        if result:
+            return [f'return {self.expr(code)}']
+        if type(code) in [dict, list]:
+            return self.block(code, False) or ['pass']
+        return ['pass']
+
+    def stmt(self, cmd: str, value: Any, result: bool) -> List[str]:
+        done = ['return None'] if result else []
+        if cmd in ['comment', 'ignore']:
+            return done
+        if cmd == 'print':
+            return [f'rt.output.emit({self.expr(value)})'] + done
+        if cmd == 'set_local':
+            if type(value) != dict or value.get('name', '') == '' or 'value' not in value:
+                raise Unsupported('invalid "set_local"')
+            val = self.expr(value['value'])
+            return [f'{self.declare(value["name"])} = {val}'] + done
+        if cmd == 'local' and type(value) == dict:
+            if 'name' not in value or 'value' not in value:
+                raise Unsupported('invalid "local"')
+            name = self.resolve(value['name'])
+            if name is None:
+                raise Unsupported('assignment to a top level local')
+            return [f'{name} = {self.expr(value["value"])}'] + ([f'return {name}'] if result else [])
+        if cmd == 'set':
+            if type(value) != dict or value.get('name', '') == '' or 'value' not in value:
+                raise Unsupported('invalid "set"')
+            target = f'rt.variables[{value["name"]!r}]'
+            return [f'{target} = {self.expr(value["value"])}'] + ([f'return {target}'] if result else [])
+        if cmd == 'if' and type(value) == dict:
+            def translate():
+                lines = [f'if {self.expr(value.get("condition", ""))}:']
+                lines.extend(indent(self.branch(value.get('then', {}), result)))
+                else_ = self.branch(value.get('else', {}), result)
+                if else_ != ['pass']:
+                    lines.extend(['else:'] + indent(else_))
+                return lines
+            return self.scoped(translate)
+        if cmd == 'for' and type(value) == dict:
+            return self.scoped(lambda: self.for_loop(value)) + done
+        if cmd == 'while' and type(value) == dict:
+            def translate():
+                return [f'while {self.expr(value.get("condition"))}:'] + indent(self.loop_body(value.get('code')) or ['pass'])
+            return self.scoped(translate) + done
+        if cmd == 'switch' and type(value) == dict and type(value.get('case', {})) == dict:
+            return self.scoped(lambda: self.switch(value)) + done
+        if cmd == 'return':
+            return self.ret(value)
+        line = self.expr({cmd: value})
+        return [f'return {line}'] if result else [line]
+
+    def loop_body(self, code: Any) -> List[str]:
+        self.depth += 1
+        try:
+            return self.block(code, False)
+        finally:
+            self.depth -= 1
+
+    def for_loop(self, value: dict) -> List[str]:
+        for_range = value.get('range')
+        if type(for_range) == dict and 'var' in for_range and ('in' in for_range or 'to' in for_range):
+            if 'in' in for_range:
+                items = self.expr(for_range['in'])
+            else:
+                items = f'range({self.expr(for_range.get("from", 0))}, {self.expr(for_range["to"])}, {self.expr(for_range.get("step", 1))})'
+            var = self.declare(for_range['var'])
+            return [f'for {var} in {items}:'] + indent(self.loop_body(value.get('code')) or ['pass'])
+        if type(for_range) != list or len(for_range) != 3:
+            raise Unsupported('invalid "for"')
+        init = self.block(for_range[0], False)
+        cond = self.expr(for_range[1])
+        body = self.loop_body(value.get('code')) + self.block(for_range[2], False)
+        return init + [f'while {cond}:'] + indent(body or ['pass'])
+
+    def switch(self, value: dict) -> List[str]:
+        key = self.temp()
+        lines = [f'{key} = str({self.expr(value["value"]) if "value" in value else None})']
+        cases = value['case']
+        keyword = 'if'
+        for k, v in cases.items():
+            if k == runtime.Constants.wildcard_symbol:
+                continue
+            lines.append(f'{keyword} {key} == {k!r}:')
+            lines.extend(indent(self.block(v, False) or ['pass']))
+            keyword = 'elif'
+        if runtime.Constants.wildcard_symbol in cases:
+            default = indent(self.block(cases[runtime.Constants.wildcard_symbol], False) or ['pass'])
+            lines.extend((['else:'] + default) if keyword == 'elif' else default)
+        return lines
+
+    def ret(self, value: Any) -> List[str]:
+        if type(value) == dict and len(value) == 1 and 'call' in value:
+            name, args = self.call_args(value['call'])
+            values = self.temp()
+            lines = [f'{values} = [{", ".join(args)}]']
+            if name == self.name and self.depth == 0 and self.args is not None and len(args) == len(self.args):
+                # A call to itself, when the name still refers to this function, starts over
+                self.loops = True
+                params = [self.resolve(x) for x in self.args]
+                lines += [f'if rt.functions.get({name!r}) is function:']
+                lines += indent([f'{", ".join(params)}, = {values}', 'continue'])
+            return lines + [f'return Return({values}, {name!r})']
+        return [f'return {self.expr(value)}']
+
+    def call_args(self, value: Any):
+        if type(value) == str:
+            return value, []
+        if type(value) != dict:
+            raise Unsupported('invalid "call"')
+        args = value.get('args', [])
+        if type(args) != list:
+            args = [args]
+        return value.get('name', ''), [self.expr(x) for x in args]
+
+    def const(self, value: Any) -> str:
+        if type(value) == float and not math.isfinite(value):
+            return f'float({repr(value)!r})'
+        if value is None or type(value) in [int, float, str, bool]:
+            return repr(value)
+        raise Unsupported(f'constant {value!r}')
+
+    def expr(self, stmt: Any) -> str:
+        if type(stmt) == list:
+            return f'[{", ".join(self.expr(x) for x in stmt)}]'
+        if type(stmt) != dict:
+            return self.const(stmt)
+        if len(stmt) != 1:
+            return f'[{", ".join(self.expr({k: v}) for k, v in stmt.items())}]'
+        (cmd, value), = stmt.items()
+        if cmd == 'local' and type(value) == str:
+            name = self.resolve(value)
+            return name if name is not None else f'rt.locals.get({value!r})'
+        if cmd == 'var':
+            if type(value) == dict and 'name' in value:
+                value = value['name']
+            if type(value) != str:
+                raise Unsupported('invalid "var"')
+            return f'rt.variables[{value!r}]'
+        if cmd == 'call':
+            name, args = self.call_args(value)
+            return f'rt.invoke_function({name!r}, [{", ".join(args)}])'
+        if cmd == 'if' and type(value) == dict:
+            # Only as a conditional expression, a block in it would need statements
+            def translate():
+                cond = self.expr(value.get('condition', ''))
+                return [f'({self.expr(value.get("then", {}))} if {cond} else {self.expr(value.get("else", {}))})']
+            lines = self.scoped(translate)
+            if len(lines) != 1:
+                raise Unsupported('"if" expression declaring locals')
+            return lines[0]
+        if cmd in Operators.binary or cmd in Operators.logical or cmd in Operators.aliases:
+            return self.operator(Operators.symbol(cmd), value)
+        if cmd in values.ops:
+            args = [self.expr(x) for x in values.operands(value)]
+            try:
+                values.ops[cmd].check_args(len(args))
+            except ArgumentMismathError:
+                raise Unsupported(f'"{cmd}" with {len(args)} operands')
+            return f'op_{cmd}({", ".join(args)})'
+        raise Unsupported(f'"{cmd}"')
+
+    def operator(self, symbol: str, value: Any) -> str:
+        if type(value) != list:
+            raise Unsupported(f'invalid "{symbol}"')
+        operands = [self.expr(x) for x in value]
+        if symbol in Operators.logical:
+            if len(operands) == 0:
+                return 'True' if symbol == '&&' else 'False'
+            return '(' + (' and ' if symbol == '&&' else ' or ').join(operands) + ')'
+        # Python applies arithmetic left to right, like the interpreter
+        if len(operands) == 0 or (symbol in Operators.comparisons and len(operands) == 1):
+            raise Unsupported(f'"{symbol}" with {len(operands)} operands')
+        if symbol in Operators.comparisons and len(operands) > 2:
+            # Chains are compared element-wise when they hold arrays, the operands are still evaluated lazily
+            rights = ', '.join(f'lambda: {x}' for x in operands[1:])
+            return f'compare(binary[{symbol!r}], {operands[0]}, (f() for f in ({rights},)))'
+        return '(' + f' {symbol} '.join(operands) + ')'
+
+def transpile(function: 'runtime.Function', rt: 'runtime.Runtime') -> Optional[Any]:
+    # Returns the Python version of the function, or None if it can't be translated
+    code = function.function
+    if rt.optimizer is not None:
+        code = rt.optimizer.optimize_block(code)
+    try:
+        source = Transpiler(function.name, function.args, function.unit.parent).transpile(code)
+    except (Unsupported, RecursionError):
+        return None
+    scope = {'Return': Return, 'function': function, 'compare': arrays.compare, 'binary': Operators.binary, '__builtins__': builtins}
+    scope.update({f'op_{k}': v.fn for k, v in values.ops.items()})
+    exec(compile(source, f'<jsonlang {function.name}>', 'exec'), scope)
+    native = scope['native']
+    native.source = source
+    return native
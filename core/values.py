@@ -0,0 +1,199 @@
+# values.py
+
+# Operations on collection values. Lists and dicts are changed in place, so
+# growing one in a loop costs amortized O(1) per item, where {"+": [...]} copies
+# the whole list or string every time. A Builder collects the parts of a string
+# and joins them once, when the string is needed.
+#
+# Every operation is an opcode, {"append": [{"local": "items"}, 1]}, whose value is
+# the list of operands (a single operand that isn't a list can be given as is),
+# and a builtin function, {"call": {"name": "append", "args": [...]}}:
+#   append  [target, value, ...]   appends to a list or a builder, yields the target
+#   get     [target, key, default] item of a list, string, dict or array, default when it's missing
+#   put     [target, key, value]   sets an item of a list, dict or array, yields the value
+#   len     target                 length of a list, string, dict, builder or array
+#   slice   [target, start, end]   copy of a part of a list, string (or builder) or array
+#   join    [items, separator]     string of the items joined by the separator
+#   dict    [[key, value], ...]    new dict
+#   builder [part, ...]            new string builder
+#   build   target                 string of a builder
+#
+# Under limits (see limits.py) the operations that grow or build a collection charge
+# the budget of the execution with the size of what they add.
+
+from typing import Any, Callable, Dict, List, Optional
+
+from .errors import *
+
+from . import arrays
+
+class Builder:
+    __slots__ = ('parts', 'length')
+
+    def __init__(self, parts: Optional[List] = None):
+        self.parts = []
+        self.length = 0
+        for x in parts or []:
+            self.append(x)
+
+    def append(self, value: Any):
+        s = str(value)
+        self.parts.append(s)
+        self.length += len(s)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        # The parts are joined once, later appends start a new list of parts after it
+        if len(self.parts) > 1:
+            self.parts = [''.join(self.parts)]
+        return self.parts[0] if len(self.parts) > 0 else ''
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
+    # Builders change in place, like lists they can't be keys (or cached arguments)
+    __hash__ = None
+
+missing = object()
+
+def type_name(value: Any) -> str:
+    if isinstance(value, Builder):
+        return 'builder'
+    return 'array' if arrays.is_array(value) else type(value).__name__
+
+def size(value: Any) -> int:
+    # What a value counts for the memory limit: characters of a string, items of a collection
+    if value.__class__ in [str, list, dict] or isinstance(value, Builder) or arrays.is_array(value):
+        return len(value)
+    return 0
+
+def append(target: Any, *values: Any) -> Any:
+    if type(target) == list:
+        if len(values) == 1:
+            target.append(values[0])
+        else:
+            target.extend(values)
+    elif isinstance(target, Builder):
+        for x in values:
+            target.append(x)
+    else:
+        raise JsonLangRuntimeError(f'"append" expects a list or a builder, got {type_name(target)}')
+    return target
+
+def get(target: Any, key: Any, default: Any = missing) -> Any:
+    if type(target) not in [list, str, dict] and not arrays.is_array(target):
+        raise JsonLangRuntimeError(f'"get" expects a list, a string, a dict or an array, got {type_name(target)}')
+    try:
+        return arrays.scalar(target[key])
+    except (IndexError, KeyError):
+        if default is not missing:
+            return default
+        raise JsonLangRuntimeError(f'"get": no item {key!r} in the {type_name(target)}')
+    except TypeError:
+        raise JsonLangRuntimeError(f'"get": a {type_name(target)} can\'t be indexed by {type_name(key)}')
+
+def put(target: Any, key: Any, value: Any) -> Any:
+    if type(target) not in [list, dict] and not arrays.is_array(target):
+        raise JsonLangRuntimeError(f'"put" expects a list, a dict or an array, got {type_name(target)}')
+    try:
+        target[key] = value
+    except IndexError:
+        raise JsonLangRuntimeError(f'"put": index {key!r} is out of range')
+    except TypeError:
+        raise JsonLangRuntimeError(f'"put": a {type_name(target)} can\'t be indexed by {type_name(key)}')
+    return value
+
+def length(target: Any) -> int:
+    if type(target) not in [list, str, dict] and not isinstance(target, Builder) and not arrays.is_array(target):
+        raise JsonLangRuntimeError(f'"len" expects a list, a string, a dict, a builder or an array, got {type_name(target)}')
+    return len(target)
+
+def slice_(target: Any, start: Optional[int] = None, end: Optional[int] = None) -> Any:
+    if isinstance(target, Builder):
+        target = str(target)
+    if type(target) not in [list, str] and not arrays.is_array(target):
+        raise JsonLangRuntimeError(f'"slice" expects a list, a string or an array, got {type_name(target)}')
+    try:
+        if arrays.is_array(target):
+            # A slice of a NumPy array is a view, the copy doesn't change with it
+            return arrays.to_array(target[start:end])
+        return target[start:end]
+    except TypeError:
+        raise JsonLangRuntimeError('"slice" expects integer bounds')
+
+def join(items: Any, separator: str = '') -> str:
+    if arrays.is_array(items):
+        items = items.tolist()
+    if type(items) != list:
+        raise JsonLangRuntimeError(f'"join" expects a list or an array, got {type_name(items)}')
+    return str(separator).join(x if type(x) == str else str(x) for x in items)
+
+def new_dict(*pairs: Any) -> Dict:
+    values = {}
+    for pair in pairs:
+        if type(pair) != list or len(pair) != 2:
+            raise JsonLangRuntimeError('"dict" expects [key, value] pairs')
+        put(values, pair[0], pair[1])
+    return values
+
+def new_builder(*parts: Any) -> Builder:
+    return Builder(list(parts))
+
+def build(target: Any) -> str:
+    if not isinstance(target, Builder):
+        raise JsonLangRuntimeError(f'"build" expects a builder, got {type_name(target)}')
+    return str(target)
+
+def appended(args: List, value: Any) -> int:
+    # A list grows by an item per value, a builder by the characters of the values
+    if isinstance(value, Builder):
+        return sum(len(str(x)) for x in args[1:])
+    return len(args) - 1
+
+def built(args: List, value: Any) -> int:
+    return size(value)
+
+class Operation:
+    def __init__(self, name: str, fn: Callable, min_args: int, max_args: Optional[int],
+                 charge: Optional[Callable[[List, Any], int]] = None):
+        # charge gives the size an operation adds, from its operands and its value
+        self.name = name
+        self.fn = fn
+        self.min_args = min_args
+        self.max_args = max_args
+        self.charge = charge
+
+    def check_args(self, count: int):
+        if count < self.min_args or (self.max_args is not None and count > self.max_args):
+            if self.max_args is None:
+                expected = f'at least {self.min_args}'
+            elif self.min_args == self.max_args:
+                expected = str(self.min_args)
+            else:
+                expected = f'{self.min_args} to {self.max_args}'
+            raise ArgumentMismathError(f'"{self.name}" expects {expected} arguments, but got {count}')
+
+    def __call__(self, rt, args: List) -> Any:
+        # As a builtin function
+        self.check_args(len(args))
+        value = self.fn(*args)
+        if self.charge is not None and rt.budget is not None:
+            rt.budget.allocate(self.charge(args, value))
+        return value
+
+ops = {op.name: op for op in [
+    Operation('append', append, 2, None, appended),
+    Operation('get', get, 2, 3),
+    Operation('put', put, 3, 3, lambda args, value: 1),
+    Operation('len', length, 1, 1),
+    Operation('slice', slice_, 1, 3, built),
+    Operation('join', join, 1, 2, built),
+    Operation('dict', new_dict, 0, None, built),
+    Operation('builder', new_builder, 0, None, built),
+    Operation('build', build, 1, 1, built),
+]}
+
+def operands(value: Any) -> List:
+    return value if type(value) == list else [value]
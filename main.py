@@ -1,15 +1,174 @@
 #!/usr/bin/env python3
 
+import time
 import sys
 
-from core.runtime import Runtime
+start, start_modules = time.perf_counter(), len(sys.modules)
+
+# Modules only some of the modes need (the REPL, the server, batches, images, async)
+# are imported in their branches, so running a file doesn't wait for them
+import argparse
+import json
+
+from core.runtime import Runtime, Constants
 from core.parser import Parser
-from core.cli import Repl
+from core.cache import ProgramCache
+from core.output import Output
+from core.limits import Limits
+from core.startup import StartupTrace
+from core.errors import InvalidArgumentsError
+
+trace = StartupTrace(start, start_modules)
+trace.mark('imports')
+
+runtimes = []
+
+def new_runtime(args):
+  rt = Runtime(args.engine, not args.no_optimize)
+  rt.output = output
+  rt.set_limits(limits)
+  runtimes.append(rt)
+  if args.image is not None:
+    from core.image import Image
+    Image.load(rt, args.image)
+  return rt
 
 if __name__ == '__main__':
-  if len(sys.argv) == 2:
-    Runtime.run(Parser.parse(open(sys.argv[1]).read()))
-  else:
-    Repl().run()
+  argparser = argparse.ArgumentParser(description='JsonLang interpreter')
+  argparser.add_argument('files', nargs='*', metavar='file',
+                         help='file to run ("-" for stdin when streaming), starts the REPL if omitted, several files are run as a batch')
+  argparser.add_argument('--engine', choices=Constants.engines, default='compiled',
+                         help='execution engine, "walker" is the reference tree walker')
+  argparser.add_argument('--cache-dir', help='directory for compiled program cache (.jlc) files, defaults to next to the sources')
+  argparser.add_argument('--no-cache', action='store_true', help="don't read or write compiled program cache files")
+  argparser.add_argument('--stream', action='store_true',
+                         help='execute top level statements while the file is being read, "program", "variables" and "import" have to come before "code"')
+  argparser.add_argument('--no-optimize', action='store_true', help="don't run the optimizer before compiling")
+  argparser.add_argument('--dump-optimized', action='store_true', help='print the optimized program instead of running it')
+  argparser.add_argument('--profile', action='store_true', help='profile the program and print a report to stderr')
+  argparser.add_argument('--profile-out', help='write the profile as collapsed stacks (for flamegraph tools) to this file')
+  argparser.add_argument('--async', dest='run_async', action='store_true',
+                         help='run the program on the async runtime, which supports spawn/await/gather and async builtins')
+  argparser.add_argument('--tier-threshold', type=int, default=Constants.tier_threshold,
+                         help='translate functions to Python after this many calls, 0 disables it')
+  argparser.add_argument('--image', help='start from a runtime image (.jli) instead of a fresh runtime')
+  argparser.add_argument('--save-image', help='run the files, then save the runtime as an image (.jli) instead of exiting')
+  argparser.add_argument('--serve', action='store_true',
+                         help='run an execution server, the files are libraries every runtime of the pool runs first')
+  argparser.add_argument('--socket', help='unix socket the server listens on')
+  argparser.add_argument('--port', type=int, help='localhost TCP port the server listens on')
+  argparser.add_argument('--host', default='127.0.0.1', help='address the server listens on with --port')
+  argparser.add_argument('--pool', type=int, default=4, help='number of runtimes of the server')
+  argparser.add_argument('--jobs', type=int, help='run the files as a batch on this many worker processes (defaults to the number of cores)')
+  argparser.add_argument('--inputs', help='run the file once for every line of this JSONL file, with the variables it holds')
+  argparser.add_argument('--output', default='-', metavar='SPEC',
+                         help='where programs print to: "-" (stdout), "null", a file, or "jsonl:" and one of them to print JSON lines')
+  argparser.add_argument('--buffer-size', type=int,
+                         help='characters of output buffered before they are written, 0 writes every line (the default on a terminal)')
+  argparser.add_argument('--max-steps', type=int, help='stop programs after this many loop iterations and function calls')
+  argparser.add_argument('--max-time', type=float, help='stop programs after running this many seconds')
+  argparser.add_argument('--max-depth', type=int, help='stop programs nesting more function calls than this')
+  argparser.add_argument('--max-memory', type=int,
+                         help='stop programs allocating more than this many string characters and collection items')
+  argparser.add_argument('--sandbox', action='store_true', help='don\'t allow programs to use "py", "breakpoint" and "import"')
+  argparser.add_argument('--startup-trace', action='store_true', help='print where the time to start up and run the program went to stderr')
+  args = argparser.parse_args()
+  args.file = args.files[0] if len(args.files) > 0 else None
+
+  if args.cache_dir is not None:
+    ProgramCache.directory = args.cache_dir
+  ProgramCache.enabled = not args.no_cache
+  Constants.tier_threshold = args.tier_threshold
+  try:
+    output = Output.open(args.output, args.buffer_size)
+    limits = None
+    if args.sandbox or any(x is not None for x in [args.max_steps, args.max_time, args.max_depth, args.max_memory]):
+      limits = Limits(args.max_steps, args.max_time, args.max_depth, args.max_memory, args.sandbox)
+  except (OSError, InvalidArgumentsError) as ex:
+    argparser.error(str(ex))
+  trace.mark('arguments')
 
-# print(f'Usage: {sys.argv[0]} FILENAME')
+  try:
+    if args.serve:
+      if (args.socket is None) == (args.port is None):
+        argparser.error('--serve needs either --socket or --port')
+      from core.server import Server, RuntimePool
+      Server(RuntimePool(args.pool, args.files, args.engine, not args.no_optimize, args.image, limits)).serve(args.socket, args.host, args.port)
+    elif args.save_image is not None:
+      from core.image import Image
+      rt = new_runtime(args)
+      for path in args.files:
+        code = Parser.parse_file(path)
+        rt.add_program(code)
+        rt.run_program(code.name)
+      Image.save(rt, args.save_image)
+    elif args.jobs is not None or args.inputs is not None or len(args.files) > 1:
+      if len(args.files) == 0:
+        argparser.error('a batch needs at least one file')
+      from core.batch import Batch, Job, read_inputs
+      if args.inputs is not None:
+        if len(args.files) != 1:
+          argparser.error('--inputs needs exactly one file')
+        jobs = read_inputs(args.inputs, args.file)
+      else:
+        jobs = [Job(i, path) for i, path in enumerate(args.files)]
+      if not Batch(jobs, args.jobs, args.engine, not args.no_optimize, limits).run(output, sys.stderr):
+        sys.exit(1)
+    elif args.dump_optimized:
+      if args.file is None:
+        argparser.error('--dump-optimized needs a file')
+      from core.optimizer import Optimizer
+      code = Parser.parse_file(args.file)
+      program = {'program': code.name, 'import': code.imports, 'variables': code.variables,
+                 'code': Optimizer().optimize_block(code.code)}
+      print(json.dumps(program, indent=2))
+    elif args.stream:
+      if args.file is None or args.file == '-':
+        new_runtime(args).run_stream(sys.stdin)
+      else:
+        with open(args.file, 'rb') as f:
+          new_runtime(args).run_stream(f)
+    elif args.profile or args.profile_out is not None:
+      if args.file is None:
+        argparser.error('--profile needs a file')
+      rt = new_runtime(args)
+      profiler = rt.enable_profiler()
+      try:
+        rt.run_code(Parser.parse_file(args.file))
+      finally:
+        if args.profile:
+          profiler.report(sys.stderr)
+        if args.profile_out is not None:
+          with open(args.profile_out, 'w') as f:
+            profiler.write_collapsed(f)
+    elif args.run_async:
+      if args.file is None:
+        argparser.error('--async needs a file')
+      import asyncio
+      asyncio.run(new_runtime(args).run_async(Parser.parse_file(args.file)))
+    elif args.file is not None:
+      code = Parser.parse_file(args.file)
+      trace.mark('parse')
+      rt = new_runtime(args)
+      trace.mark('runtime')
+      if rt.engine == 'compiled':
+        # Functions are compiled when they're first called, while running
+        code.compiled = rt.compile_program(code.code, code.name)
+        trace.mark('compile')
+      rt.add_program(code)
+      rt.run_program(code.name)
+    else:
+      from core.cli import Repl
+      repl = Repl()
+      repl.set_runtime(new_runtime(args))
+      repl.run()
+  finally:
+    output.close()
+    trace.mark('run')
+    if args.startup_trace:
+      trace.report(sys.stderr, runtimes)
+    if limits is not None and args.file is not None:
+      # What the programs consumed of their limits
+      for rt in runtimes:
+        if rt.usage is not None:
+          sys.stderr.write(f'usage: {rt.usage}\n')
@@ -0,0 +1,12 @@
+# conftest.py
+
+# The tests import the interpreter from the repository root, and run programs
+# (whose imports are relative to it) from there
+
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
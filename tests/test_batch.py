@@ -0,0 +1,41 @@
+# test_batch.py
+
+import io
+import json
+
+from core.batch import Batch, Job, read_inputs
+from core.output import CaptureOutput
+
+def write_program(tmp_path, program: dict) -> str:
+    path = tmp_path / 'job.json'
+    path.write_text(json.dumps(program))
+    return str(path)
+
+def run_batch(jobs, workers: int = 1):
+    out, err = CaptureOutput(), io.StringIO()
+    ok = Batch(jobs, workers).run(out, err)
+    return ok, out.getvalue(), err.getvalue()
+
+def test_jobs_dont_share_variables(tmp_path):
+    # Every job appends to its own copy of the program's list
+    path = write_program(tmp_path, {'program': 'acc', 'variables': {'acc': []}, 'code': [
+        {'append': [{'var': 'acc'}, {'var': 'x'}]},
+        {'print': {'len': {'var': 'acc'}}},
+    ]})
+    ok, output, _ = run_batch([Job(i, path, {'x': i}) for i in range(3)])
+    assert ok
+    assert output == '1\n1\n1\n'
+
+def test_inputs_and_failures_in_order(tmp_path):
+    path = write_program(tmp_path, {'program': 'div', 'variables': {'x': 1}, 'code': [
+        {'print': {'/': [12, {'var': 'x'}]}},
+    ]})
+    inputs = tmp_path / 'inputs.jsonl'
+    inputs.write_text('{"x": 3}\n\n{"x": 0}\n{"x": 4}\n')
+    jobs = read_inputs(str(inputs), path)
+    assert len(jobs) == 3
+    ok, output, err = run_batch(jobs, 2)
+    assert not ok
+    assert output == '4.0\n3.0\n'
+    assert 'job 1' in err and 'ZeroDivisionError' in err
+    assert '3 jobs, 1 failed' in err
@@ -0,0 +1,35 @@
+# test_definitions.py
+
+from core.runtime import Runtime
+from core.code import Code
+from core.output import CaptureOutput
+
+def run(program: dict) -> str:
+    rt = Runtime()
+    rt.output = CaptureOutput()
+    rt.run_code(Code.from_json(program))
+    return rt.output.getvalue()
+
+def test_names_resolve_where_the_function_is_defined():
+    # The body is compiled on the first call, after the local x was declared in outer,
+    # it still reads the top level x, as if it was compiled with the def
+    program = {'program': 'shadow', 'code': [
+        {'set_local': {'name': 'x', 'value': 'global'}},
+        {'def': {'name': 'outer', 'args': [], 'code': [
+            {'def': {'name': 'inner', 'args': [], 'code': [{'return': {'local': 'x'}}]}},
+            {'print': {'call': {'name': 'inner', 'args': []}}},
+            {'set_local': {'name': 'x', 'value': 'outer'}},
+            {'print': {'call': {'name': 'inner', 'args': []}}},
+        ]}},
+        {'call': {'name': 'outer', 'args': []}},
+    ]}
+    assert run(program) == 'global\nglobal\n'
+
+def test_functions_are_compiled_on_their_first_call():
+    rt = Runtime()
+    rt.run_code(Code.from_json({'program': 'lazy', 'code': [
+        {'def': {'name': 'f', 'args': ['a'], 'code': [{'return': {'+': [{'local': 'a'}, 1]}}]}},
+    ]}))
+    assert rt.functions['f'].unit is None
+    assert rt.invoke_function('f', [1]) == 2
+    assert rt.functions['f'].unit is not None
@@ -0,0 +1,61 @@
+# test_engines.py
+
+# Differential tests: the walker is the reference engine, every program in json/,
+# bench/workloads and tests/programs has to print the same on the compiled engine,
+# with and without the optimizer, with functions translated to Python from their
+# first call, and on the async runtime.
+
+import asyncio
+import functools
+import glob
+import os
+
+import pytest
+
+from conftest import ROOT
+
+from core.runtime import Runtime, Constants
+from core.parser import Parser
+from core.cache import ProgramCache
+from core.output import CaptureOutput
+
+# locals.json prints the walker's scope dicts, which the compiled engine doesn't have
+excluded = ['json/locals.json']
+
+patterns = ['json/*.json', 'bench/workloads/*.json', 'bench/workloads/*/main.json', 'tests/programs/*.json']
+programs = sorted(x for pattern in patterns for x in glob.glob(pattern, root_dir=ROOT) if x not in excluded)
+
+configurations = {
+    'compiled': {},
+    'no-optimize': {'optimize': False},
+    'tier-threshold-1': {'tier_threshold': 1},
+    'no-optimize-tier-threshold-1': {'optimize': False, 'tier_threshold': 1},
+    'async': {'run_async': True},
+}
+
+# The programs are parsed again every time, the tests don't leave .jlc files behind
+ProgramCache.enabled = False
+
+def run(path: str, engine: str = 'compiled', optimize: bool = True, tier_threshold: int = Constants.tier_threshold,
+        run_async: bool = False) -> str:
+    rt = Runtime(engine, optimize)
+    rt.tier_threshold = tier_threshold
+    rt.output = CaptureOutput()
+    code = Parser.parse_file(os.path.join(ROOT, path))
+    if run_async:
+        asyncio.run(rt.run_async(code))
+    else:
+        rt.run_code(code)
+    return rt.output.getvalue()
+
+@functools.lru_cache(maxsize=None)
+def reference(path: str) -> str:
+    return run(path, 'walker')
+
+def test_programs_found():
+    assert len(programs) >= 8
+
+@pytest.mark.parametrize('configuration', configurations)
+@pytest.mark.parametrize('path', programs)
+def test_same_output_as_walker(path, configuration):
+    assert run(path, **configurations[configuration]) == reference(path)
@@ -0,0 +1,50 @@
+# test_limits.py
+
+import pytest
+
+from core.runtime import Runtime
+from core.code import Code
+from core.limits import Limits
+from core.output import CaptureOutput
+from core.errors import LimitExceededError
+from core.cache import ProgramCache
+
+from core import modules
+
+def run(program: dict, engine: str = 'compiled', optimize: bool = True, limits: Limits = None) -> str:
+    rt = Runtime(engine, optimize)
+    rt.output = CaptureOutput()
+    rt.set_limits(limits)
+    rt.run_code(Code.from_json(program))
+    return rt.output.getvalue()
+
+def repeat(string: str, count: int) -> dict:
+    return {'program': 'repeat', 'code': [{'print': {'len': {'*': [string, count]}}}]}
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+@pytest.mark.parametrize('optimize', [True, False])
+def test_constant_strings_are_charged(engine, optimize):
+    # Folding the operator while compiling mustn't build the string for free
+    with pytest.raises(LimitExceededError):
+        run(repeat('ab', 50_000_000), engine, optimize, Limits(memory=1000, sandbox=True))
+    with pytest.raises(LimitExceededError):
+        run(repeat('ab', 500), engine, optimize, Limits(memory=100))
+
+def test_constant_strings_within_the_limit():
+    assert run(repeat('ab', 500), limits=Limits(memory=1000)) == '1000\n'
+    assert run(repeat('ab', 500)) == '1000\n'
+
+def test_sandbox_doesnt_read_imports(tmp_path, monkeypatch):
+    # Not even the files named by imports that never run are read ahead, or cached
+    secret = tmp_path / 'secret.json'
+    secret.write_text('{"program": "secret", "code": []}')
+    read = []
+    monkeypatch.setattr(ProgramCache, 'enabled', True)
+    monkeypatch.setattr(modules, 'read_source', lambda path: read.append(path))
+    program = {'program': 'dead', 'variables': {'never': False}, 'code': [
+        {'if': {'condition': {'var': 'never'}, 'then': {'import': str(secret)}}},
+        {'print': 'done'},
+    ]}
+    assert run(program, limits=Limits(sandbox=True)) == 'done\n'
+    assert read == []
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['secret.json']
@@ -0,0 +1,49 @@
+# test_modules.py
+
+import json
+
+import pytest
+
+from core.runtime import Runtime
+from core.code import Code
+from core.output import CaptureOutput
+from core.errors import ImportCycleError
+
+def write(tmp_path, name: str, program: dict) -> str:
+    path = tmp_path / name
+    path.write_text(json.dumps(program))
+    return str(path)
+
+def run(program: dict, rt: Runtime = None) -> str:
+    rt = rt or Runtime()
+    rt.output = CaptureOutput()
+    rt.run_code(Code.from_json(program))
+    return rt.output.getvalue()
+
+def test_files_are_imported_once(tmp_path):
+    # base is imported by both a and b, and by the program itself
+    base = write(tmp_path, 'base.json', {'program': 'base', 'code': [{'print': 'base'}]})
+    a = write(tmp_path, 'a.json', {'program': 'a', 'import': [base], 'code': [{'print': 'a'}]})
+    b = write(tmp_path, 'b.json', {'program': 'b', 'import': [base], 'code': [{'print': 'b'}]})
+    rt = Runtime()
+    assert run({'program': 'main', 'import': [a, b, base], 'code': [{'import': base}, {'print': 'main'}]}, rt) == 'base\na\nb\nmain\n'
+    # Also in later programs of the same runtime
+    assert run({'program': 'again', 'import': [a], 'code': [{'print': 'again'}]}, rt) == 'again\n'
+
+def test_changed_files_are_imported_again(tmp_path):
+    path = tmp_path / 'lib.json'
+    path.write_text(json.dumps({'program': 'lib', 'code': [{'print': 'first'}]}))
+    rt = Runtime()
+    assert run({'program': 'main', 'import': [str(path)], 'code': []}, rt) == 'first\n'
+    # The new content has another size, the mtime may not have changed yet
+    path.write_text(json.dumps({'program': 'lib', 'code': [{'print': 'second version'}]}))
+    assert run({'program': 'main', 'import': [str(path)], 'code': []}, rt) == 'second version\n'
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+def test_import_cycles_are_errors(tmp_path, engine):
+    a, b = str(tmp_path / 'a.json'), str(tmp_path / 'b.json')
+    write(tmp_path, 'a.json', {'program': 'a', 'import': [b], 'code': []})
+    write(tmp_path, 'b.json', {'program': 'b', 'code': [{'import': a}]})
+    with pytest.raises(ImportCycleError) as error:
+        run({'program': 'main', 'import': [a], 'code': []}, Runtime(engine))
+    assert 'a.json -> ' in str(error.value) and 'b.json' in str(error.value)
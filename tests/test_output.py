@@ -0,0 +1,87 @@
+# test_output.py
+
+import io
+import json
+
+import pytest
+
+from core.runtime import Runtime
+from core.code import Code
+from core.output import Output, CaptureOutput, NullOutput
+from core.errors import InvalidArgumentsError
+
+def test_buffered_until_full():
+    stream = io.StringIO()
+    out = Output(stream, 10)
+    out.emit('abcd')
+    out.emit(12)
+    assert stream.getvalue() == ''
+    out.emit('x')
+    assert stream.getvalue() == 'abcd\n12\nx\n'
+    out.write('job\n')
+    out.flush()
+    assert stream.getvalue() == 'abcd\n12\nx\njob\n'
+    assert out.size == 0
+
+def test_unbuffered():
+    stream = io.StringIO()
+    out = Output(stream, 0)
+    out.emit('a')
+    assert stream.getvalue() == 'a\n'
+    out.emit_all([1, 'b', None])
+    assert stream.getvalue() == 'a\n1 b None\n'
+
+def test_records():
+    out = CaptureOutput(True)
+    out.emit('a')
+    out.emit({'x': [1, 2]})
+    out.emit_all([3])
+    out.emit_all([3, 'c'])
+    assert [json.loads(x) for x in out.getvalue().splitlines()] == ['a', {'x': [1, 2]}, 3, [3, 'c']]
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+def test_program_records(engine):
+    rt = Runtime(engine)
+    rt.output = CaptureOutput(True)
+    rt.run_code(Code.from_json({'program': 'records', 'variables': {'items': [1, 2]}, 'code': [
+        {'print': {'var': 'items'}},
+        {'print': 'text'},
+        {'call': {'name': 'print', 'args': [1, 'b']}},
+    ]}))
+    assert rt.output.getvalue() == '[1, 2]\n"text"\n[1, "b"]\n'
+
+def test_stdout_at_write_time(capsys):
+    out = Output(None, 0)
+    out.emit('hello')
+    assert capsys.readouterr().out == 'hello\n'
+
+def test_open_file(tmp_path):
+    path = tmp_path / 'out.txt'
+    out = Output.open(str(path), 1 << 10)
+    out.emit('a')
+    out.emit('b')
+    out.close()
+    assert path.read_text() == 'a\nb\n'
+    assert out.stream.closed
+    out = Output.open(f'jsonl:{path}')
+    assert out.records
+    out.emit('a')
+    out.close()
+    assert path.read_text() == '"a"\n'
+
+def test_open_null():
+    out = Output.open('null')
+    assert type(out) == NullOutput
+    out.emit('a')
+    out.emit_all(['a'])
+    out.write('a')
+    out.close()
+    assert out.parts == []
+
+def test_open_stdout():
+    out = Output.open('jsonl:-', 0)
+    assert out.stream is None and out.records and out.buffer_size == 0
+
+def test_negative_buffer_size():
+    with pytest.raises(InvalidArgumentsError):
+        Output.open('-', -1)
@@ -0,0 +1,72 @@
+# test_parallel.py
+
+import pytest
+
+from core.runtime import Runtime
+from core.code import Code
+from core.output import CaptureOutput
+from core.errors import JsonLangRuntimeError, InvalidArgumentsError
+
+def run(program: dict, engine: str = 'compiled') -> str:
+    rt = Runtime(engine)
+    rt.output = CaptureOutput()
+    rt.run_code(Code.from_json(program))
+    return rt.output.getvalue()
+
+square = {'def': {'name': 'sq', 'args': ['x'], 'code': [{'return': {'*': [{'local': 'x'}, {'local': 'x'}]}}]}}
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_pmap(engine, backend):
+    assert run({'program': 'pmap', 'code': [
+        square,
+        {'print': {'pmap': {'function': 'sq', 'in': [1, 2, 3, 4, 5], 'workers': 2, 'backend': backend, 'chunk_size': 2}}},
+    ]}, engine) == '[1, 4, 9, 16, 25]\n'
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_parallel_for(engine, backend):
+    # Variables can be read, and what the iterations print comes out in the order of the items
+    assert run({'program': 'parallel', 'variables': {'base': 10}, 'code': [
+        {'print': {'parallel_for': {'range': {'var': 'c', 'from': 0, 'to': 4}, 'workers': 2, 'backend': backend, 'code': [
+            {'print': {'local': 'c'}},
+            {'return': {'+': [{'var': 'base'}, {'local': 'c'}]}},
+        ]}}},
+    ]}, engine) == '0\n1\n2\n3\n[10, 11, 12, 13]\n'
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_reduce(backend):
+    assert run({'program': 'reduce', 'code': [
+        square,
+        {'def': {'name': 'largest', 'args': ['a', 'b'], 'code': [
+            {'if': {'condition': {'>': [{'local': 'a'}, {'local': 'b'}]}, 'then': {'return': {'local': 'a'}}}},
+            {'return': {'local': 'b'}},
+        ]}},
+        {'print': {'pmap': {'function': 'sq', 'in': [1, 2, 3], 'workers': 2, 'backend': backend, 'reduce': '+'}}},
+        {'print': {'pmap': {'function': 'sq', 'in': [3, -5, 4], 'workers': 2, 'backend': backend, 'reduce': 'largest'}}},
+        {'print': {'pmap': {'function': 'sq', 'in': [], 'reduce': '+'}}},
+    ]}) == '14\n25\nNone\n'
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+@pytest.mark.parametrize('code', [
+    [{'set': {'name': 'total', 'value': 1}}],
+    [{'append': [{'var': 'seen'}, {'local': 'c'}]}],
+    [{'def': {'name': 'f', 'args': [], 'code': []}}],
+])
+def test_writes_are_errors(engine, code):
+    with pytest.raises(JsonLangRuntimeError):
+        run({'program': 'writes', 'variables': {'total': 0, 'seen': []}, 'code': [
+            {'parallel_for': {'range': {'var': 'c', 'from': 0, 'to': 4}, 'code': code, 'workers': 2, 'backend': 'thread'}},
+        ]}, engine)
+
+def test_functions_cant_set_variables():
+    with pytest.raises(JsonLangRuntimeError):
+        run({'program': 'writes', 'variables': {'total': 0}, 'code': [
+            {'def': {'name': 'add', 'args': ['x'], 'code': [{'set': {'name': 'total', 'value': {'local': 'x'}}}]}},
+            {'pmap': {'function': 'add', 'in': [1, 2], 'workers': 2, 'backend': 'thread'}},
+        ]})
+
+@pytest.mark.parametrize('options', [{'workers': 0}, {'chunk_size': 'a'}, {'backend': 'fiber'}, {'reduce': 1}])
+def test_invalid_options(options):
+    with pytest.raises(InvalidArgumentsError):
+        run({'program': 'options', 'code': [square, {'pmap': {'function': 'sq', 'in': [1], **options}}]})
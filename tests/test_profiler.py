@@ -0,0 +1,77 @@
+# test_profiler.py
+
+import io
+
+import pytest
+
+from core.runtime import Runtime
+from core.code import Code
+from core.profiler import Profiler
+from core.output import CaptureOutput
+
+class Clock:
+    # Every reading is one second later
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 1.0
+        return self.now
+
+def test_self_and_total_time():
+    profiler = Profiler(Clock())
+    def inner(rt, args):
+        return 1
+    def outer(rt, args):
+        return profiler.call('inner', inner, rt, args)
+    profiler.call('outer', outer, None, [])
+    outer_stat, inner_stat = profiler.stats['function']['outer'], profiler.stats['function']['inner']
+    # outer: entered at 1, left at 4, inner: entered at 2, left at 3
+    assert (outer_stat.calls, outer_stat.total, outer_stat.self_time) == (1, 3.0, 2.0)
+    assert (inner_stat.calls, inner_stat.total, inner_stat.self_time) == (1, 1.0, 1.0)
+    out = io.StringIO()
+    profiler.write_collapsed(out)
+    assert out.getvalue() == 'outer 2000000\nouter;inner 1000000\n'
+
+def test_recursion_is_counted_once_in_the_total():
+    profiler = Profiler(Clock())
+    def countdown(rt, args):
+        if args[0] > 0:
+            profiler.call('countdown', countdown, rt, [args[0] - 1])
+    profiler.call('countdown', countdown, None, [2])
+    stat = profiler.stats['function']['countdown']
+    assert stat.calls == 3
+    assert stat.total == 5.0
+    assert stat.self_time == 5.0
+
+def test_reset():
+    profiler = Profiler(Clock())
+    profiler.call('f', lambda rt, args: None, None, [])
+    stat = profiler.stats['function']['f']
+    profiler.reset()
+    assert (stat.calls, stat.total, stat.self_time) == (0, 0.0, 0.0)
+    assert profiler.stacks == {}
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+def test_profiled_programs(engine):
+    program = Code.from_json({'program': 'fib', 'code': [
+        {'def': {'name': 'fib', 'args': ['n'], 'code': [
+            {'if': {'condition': {'<': [{'local': 'n'}, 2]}, 'then': {'return': {'local': 'n'}}}},
+            {'return': {'+': [{'call': {'name': 'fib', 'args': [{'-': [{'local': 'n'}, 1]}]}},
+                              {'call': {'name': 'fib', 'args': [{'-': [{'local': 'n'}, 2]}]}}]}},
+        ]}},
+        {'print': {'call': {'name': 'fib', 'args': [10]}}},
+    ]})
+    rt = Runtime(engine)
+    rt.output = CaptureOutput()
+    profiler = rt.enable_profiler()
+    rt.run_code(program)
+    assert rt.output.getvalue() == '55\n'
+    assert profiler.stats['function']['fib'].calls == 177
+    if engine == 'compiled':
+        # The walker only profiles functions
+        assert profiler.stats['opcode']['+'].calls >= 88
+        assert any(x.startswith('fib.') for x in profiler.stats['location'])
+    out = io.StringIO()
+    profiler.report(out)
+    assert 'fib' in out.getvalue()
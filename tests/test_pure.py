@@ -0,0 +1,43 @@
+# test_pure.py
+
+from core.runtime import Runtime, CallCache
+from core.code import Code
+
+def pure_runtime(code: list, cache_size: int = 128) -> Runtime:
+    rt = Runtime()
+    rt.run_code(Code.from_json({'program': 'pure', 'code': [
+        {'def': {'name': 'f', 'args': ['x'], 'pure': True, 'cache_size': cache_size, 'code': code}},
+    ]}))
+    return rt
+
+def test_hits_and_misses():
+    rt = pure_runtime([{'return': {'*': [{'local': 'x'}, 2]}}])
+    assert [rt.invoke_function('f', [x]) for x in [1, 2, 1, 1, True]] == [2, 4, 2, 2, 2]
+    cache = rt.functions['f'].cache
+    # true is a different argument than 1
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 3, 0)
+
+def test_least_recently_used_are_evicted():
+    rt = pure_runtime([{'return': {'local': 'x'}}], 2)
+    for x in [1, 2, 1, 3]:
+        rt.invoke_function('f', [x])
+    cache = rt.functions['f'].cache
+    assert cache.evictions == 1
+    # 2 was used least recently
+    assert list(cache.entries) == [CallCache.key([1]), CallCache.key([3])]
+    rt.invoke_function('f', [2])
+    assert cache.misses == 4
+
+def test_unhashable_arguments_arent_cached():
+    rt = pure_runtime([{'return': {'len': {'local': 'x'}}}])
+    assert rt.invoke_function('f', [[1, 2]]) == 2
+    assert len(rt.functions['f'].cache.entries) == 0
+
+def test_results_are_copied():
+    # Changing a returned list doesn't change what later calls return
+    rt = pure_runtime([{'return': [{'local': 'x'}]}])
+    first = rt.invoke_function('f', [1])
+    first.append('changed')
+    assert rt.invoke_function('f', [1]) == [1]
+    rt.invoke_function('f', [1]).append('changed')
+    assert rt.invoke_function('f', [1]) == [1]
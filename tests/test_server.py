@@ -0,0 +1,32 @@
+# test_server.py
+
+import json
+
+from core.server import RuntimePool, Server
+
+def make_server(tmp_path, size: int = 2) -> Server:
+    library = tmp_path / 'library.json'
+    library.write_text(json.dumps({'program': 'library', 'variables': {'seen': []}, 'code': [
+        {'def': {'name': 'visit', 'args': ['x'], 'code': [
+            {'append': [{'var': 'seen'}, {'local': 'x'}]},
+            {'return': {'len': {'var': 'seen'}}},
+        ]}},
+    ]}))
+    return Server(RuntimePool(size, [str(library)]))
+
+def test_requests_are_isolated_across_runtimes(tmp_path):
+    # Consecutive requests run on different runtimes of the pool, neither sees what the other appended
+    server = make_server(tmp_path)
+    results = [server.handle({'id': i, 'call': 'visit', 'args': [i]}) for i in range(4)]
+    assert [x['ok'] for x in results] == [True] * 4
+    assert [x['result'] for x in results] == [1, 1, 1, 1]
+
+def test_program_requests(tmp_path):
+    server = make_server(tmp_path, 1)
+    response = server.handle({'id': 7, 'program': {'program': 'p', 'code': [
+        {'print': {'call': {'name': 'visit', 'args': [{'var': 'x'}]}}},
+    ]}, 'variables': {'x': 5}})
+    assert response['id'] == 7 and response['ok']
+    assert response['output'] == '1\n'
+    response = server.handle({'id': 8, 'call': 'missing'})
+    assert not response['ok'] and 'Unknown function' in response['error']
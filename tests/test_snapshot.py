@@ -0,0 +1,32 @@
+# test_snapshot.py
+
+from core.runtime import Runtime
+from core.code import Code
+
+counter = {'program': 'counter', 'code': [
+    {'def': {'name': 'make', 'args': [], 'code': [
+        {'set_local': {'name': 'items', 'value': []}},
+        {'def': {'name': 'push', 'args': [], 'code': [
+            {'append': [{'local': 'items'}, 1]},
+            {'return': {'len': {'local': 'items'}}},
+        ]}},
+        {'def': {'name': 'count', 'args': [], 'code': [{'return': {'len': {'local': 'items'}}}]}},
+    ]}},
+    {'call': {'name': 'make', 'args': []}},
+]}
+
+def test_restore_resets_closures():
+    rt = Runtime()
+    rt.run_code(Code.from_json(counter))
+    snapshot = rt.snapshot()
+    for _ in range(3):
+        assert rt.invoke_function('push', []) == 1
+        rt.restore(snapshot)
+    assert rt.invoke_function('count', []) == 0
+
+def test_closures_share_their_frame_after_restore():
+    rt = Runtime()
+    rt.run_code(Code.from_json(counter))
+    rt.restore(rt.snapshot())
+    rt.invoke_function('push', [])
+    assert rt.invoke_function('count', []) == 1
@@ -0,0 +1,48 @@
+# test_startup.py
+
+import io
+import os
+import subprocess
+import sys
+
+from core import startup
+from core.runtime import Runtime
+from core.code import Code
+from core.output import CaptureOutput
+from core.startup import StartupTrace
+
+def test_report(monkeypatch):
+    clock = iter([0.5, 2.0])
+    monkeypatch.setattr(startup.time, 'perf_counter', lambda: next(clock))
+    trace = StartupTrace(0.0, len(sys.modules))
+    trace.mark('parse')
+    trace.mark('run')
+    rt = Runtime('compiled')
+    rt.output = CaptureOutput()
+    # Only called functions are compiled
+    rt.run_code(Code.from_json({'program': 'defs', 'code': [
+        {'def': {'name': 'used', 'args': [], 'code': [{'return': 1}]}},
+        {'def': {'name': 'unused', 'args': [], 'code': [{'return': 2}]}},
+        {'print': {'call': {'name': 'used', 'args': []}}},
+    ]}))
+    out = io.StringIO()
+    trace.report(out, [rt, Runtime('walker')])
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'startup trace:'
+    assert lines[1].split()[:2] == ['parse', '500.000ms']
+    assert lines[2].split()[:2] == ['run', '1500.000ms']
+    assert lines[3].split() == ['total', '2000.000ms']
+    assert lines[4].strip() == 'functions: 2 defined, 1 compiled'
+    assert len(lines) == 5
+
+def test_main(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = tmp_path / 'hello.json'
+    path.write_text('{"program": "hello", "code": [{"print": "hello"}]}')
+    result = subprocess.run([sys.executable, os.path.join(root, 'main.py'), '--startup-trace', str(path)],
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0
+    assert result.stdout == 'hello\n'
+    phases = [x.split()[0] for x in result.stderr.splitlines()[1:]]
+    assert phases[:6] == ['imports', 'arguments', 'parse', 'runtime', 'compile', 'run']
+    assert 'total' in phases
@@ -0,0 +1,55 @@
+# test_stream.py
+
+import io
+import json
+
+import pytest
+
+from conftest import ROOT
+
+from core.runtime import Runtime
+from core.parser import Parser
+from core.stream import ProgramStream
+from core.output import CaptureOutput
+from core.errors import ParseError
+
+program = {
+    'program': 'streamed',
+    'variables': {'name': 'wörld', 'n': 12345},
+    'code': [
+        {'print': {'+': ['hello ', {'var': 'name'}]}},
+        {'print': {'*': [{'var': 'n'}, 2]}},
+        {'set': {'name': 'items', 'value': [1, 2.5, 'three', None, True]}},
+        {'print': {'var': 'items'}},
+    ],
+    'comment': 'after the code',
+}
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1 << 16])
+def test_statements_are_read_one_by_one(monkeypatch, chunk_size):
+    # Small chunks split keys, numbers and multi-byte characters
+    monkeypatch.setattr(ProgramStream, 'chunk_size', chunk_size)
+    stream = ProgramStream(io.BytesIO(json.dumps(program, ensure_ascii=False).encode()))
+    header = stream.read_header()
+    assert header.name == 'streamed'
+    assert header.variables == program['variables']
+    assert list(stream.statements()) == program['code']
+
+@pytest.mark.parametrize('engine', ['compiled', 'walker'])
+def test_streamed_programs_print_the_same(engine):
+    path = f'{ROOT}/tests/programs/features.json'
+    rt = Runtime(engine)
+    rt.output = CaptureOutput()
+    rt.run_code(Parser.parse_file(path))
+    expected = rt.output.getvalue()
+    rt = Runtime(engine)
+    rt.output = CaptureOutput()
+    with open(path, 'rb') as f:
+        rt.run_stream(f)
+    assert rt.output.getvalue() == expected
+
+def test_header_after_code_is_an_error():
+    stream = ProgramStream(io.StringIO('{"code": [{"print": 1}], "variables": {}}'))
+    stream.read_header()
+    with pytest.raises(ParseError):
+        list(stream.statements())